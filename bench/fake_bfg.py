@@ -0,0 +1,379 @@
+import base64
+import gzip
+import hashlib
+import json
+import re
+import struct
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import count
+from threading import Lock, Thread, Timer
+from urllib.parse import parse_qs, urlsplit
+
+__all__ = [
+    'FakeBFG',
+]
+
+_WS_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+_COLLECTION = re.compile(r'^/rest/collection/(\w+)$')
+_SIMULATION_SESSION = re.compile(r'^/rest/simulation_session/(\d+)$')
+_SIMULATION_ACTION = re.compile(r'^/action/simulation/(\d+)$')
+_REPORT = re.compile(
+    r'^/data/static_result/(\d+)/consolidated/product_supply/preprocessed$'
+)
+_ORDER_SUPPLY = re.compile(
+    r'^/data/static_result/(\d+)/consolidated/order_supply$'
+)
+_IMPORT_STATUS = re.compile(r'^/action/import/(\w+)$')
+
+
+def _ws_frame(text):
+    payload = text.encode('utf-8')
+    length = len(payload)
+    if length < 126:
+        header = struct.pack('!BB', 0x81, length)
+    elif length < 1 << 16:
+        header = struct.pack('!BBH', 0x81, 126, length)
+    else:
+        header = struct.pack('!BBQ', 0x81, 127, length)
+    return header + payload
+
+
+class FakeBFG(object):
+    """
+    Local stand-in for a BFG server, good enough to drive IARest and
+    main.py without production access.
+
+    HTTP: action/login, action/primary_simulation_session (GET and POST),
+    rest/collection/<table> with start/stop pagination, meta.count and
+    the `id gt N` filter,
+    rest/simulation_session (list, create, delete), simulation start,
+    state allocation, static_result reports that answer
+    STATIC_REPORT_HAS_NOT_BEEN_PROCEED_YET for the first
+    `report_not_ready` probes, file uploads (plain, chunked or gzip; each
+    one is kept in `uploads` with its headers and decoded body) and
+    imports that finish at once.
+
+    Websocket: /message pushes SIMULATION_SESSION_* events
+    `simulation_seconds` after a simulation is started,
+    STATE_ALLOCATION_COMPLETED after allocation, and
+    PRIMARY_SIMULATION_SESSION_CHANGED whenever the primary session
+    changes.
+
+    `latency` is added to every HTTP answer, `rows` sets the size of every
+    collection and `row_width` the number of extra string fields per row.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, rows=10000,
+                 row_width=8, report_rows=None, report_not_ready=0,
+                 simulation_seconds=0.5, primary_session=1):
+        self.latency = latency
+        self.rows = rows
+        self.row_width = row_width
+        self.report_rows = rows if report_rows is None else report_rows
+        self.report_not_ready = report_not_ready
+        self.simulation_seconds = simulation_seconds
+        self.primary_session = primary_session
+
+        self.requests = 0
+        self.uploaded_bytes = 0
+        self.uploads = []
+        self.simulation_sessions = {}
+        self._session_ids = count(primary_session + 1)
+        self._report_probes = 0
+        self._lock = Lock()
+        self._sockets = []
+
+        handler = type('Handler', (_Handler,), {'bfg': self})
+        self._server = ThreadingHTTPServer((host, port), handler)
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}/'
+
+    @property
+    def ws_url(self):
+        host, port = self._server.server_address[:2]
+        return f'ws://{host}:{port}'
+
+    def config(self, **extra):
+        """IA config section pointing at this server."""
+        return {
+            'url': self.url,
+            'ws_url': self.ws_url,
+            'login': 'bench',
+            'password': 'bench',
+            'credentials': None,
+            **extra
+        }
+
+    def start(self):
+        self._thread = Thread(target=self._server.serve_forever,
+                              daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        with self._lock:
+            sockets, self._sockets = self._sockets, []
+        for sock in sockets:
+            try:
+                sock.close()
+            except OSError:
+                pass
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def broadcast(self, msg, data=None):
+        frame = _ws_frame(json.dumps({'msg': msg, 'data': data}))
+        with self._lock:
+            sockets = list(self._sockets)
+        for sock in sockets:
+            try:
+                sock.sendall(frame)
+            except OSError:
+                with self._lock:
+                    if sock in self._sockets:
+                        self._sockets.remove(sock)
+
+    def set_primary(self, session_id):
+        self.primary_session = session_id
+        self.broadcast('PRIMARY_SIMULATION_SESSION_CHANGED',
+                       {'simulation_session_id': str(session_id)})
+
+    def make_row(self, table, index):
+        row = {
+            'id': index + 1,
+            'identity': f'{table}-{index + 1}',
+            'parent_id': index // 10,
+            'child_id': index % 10,
+            'type': 2,
+            'status': 0,
+        }
+        for field in range(self.row_width):
+            row[f'field_{field}'] = f'value {index % 97} {field}'
+        return row
+
+    def _finish_simulation(self, session_id):
+        self.simulation_sessions[session_id]['status'] = 0
+        self.broadcast('SIMULATION_SESSION_SUCCESSFULLY_FINISHED',
+                       {'simulation_session_id': str(session_id)})
+
+    def handle(self, method, path, query, body):
+        """Returns (status, json-serializable answer) for one request."""
+        if path == '/action/login':
+            return 200, {'data': {'id': 1, 'login': 'bench'}}
+        if path == '/action/primary_simulation_session':
+            if method == 'POST':
+                self.set_primary(body['data']['simulation_session_id'])
+            return 200, {'data': self.primary_session}
+
+        match = _COLLECTION.match(path)
+        if match:
+            table = match[1]
+            start = int(query.get('start', ['0'])[0])
+            stop = int(query.get('stop', [str(self.rows)])[0])
+            if table == 'simulation_session':
+                rows = sorted(self.simulation_sessions.values(),
+                              key=lambda row: row['id'])
+                flt = re.search(r'id eq (\d+)', query.get('filter', [''])[0])
+                if flt:
+                    rows = [row for row in rows if row['id'] == int(flt[1])]
+                return 200, {'meta': {'count': len(rows)},
+                             table: rows[start:stop]}
+            first = 0
+            flt = re.search(r'id gt (\d+)', query.get('filter', [''])[0])
+            if flt:
+                first = min(int(flt[1]), self.rows)
+            return 200, {
+                'meta': {'count': self.rows - first},
+                table: [
+                    self.make_row(table, index)
+                    for index in range(first + start,
+                                       min(first + stop, self.rows))
+                ]
+            }
+
+        if path == '/rest/simulation_session':
+            if method == 'POST':
+                session_id = next(self._session_ids)
+                row = dict(body['simulation_session'], id=session_id,
+                           status=None)
+                self.simulation_sessions[session_id] = row
+                return 200, {'simulation_session': row}
+            return 200, {'simulation_session': sorted(
+                self.simulation_sessions.values(), key=lambda row: row['id']
+            )}
+        match = _SIMULATION_SESSION.match(path)
+        if match:
+            session_id = int(match[1])
+            if method == 'DELETE':
+                self.simulation_sessions.pop(session_id, None)
+                return 200, {}
+            return 200, {'simulation_session':
+                         self.simulation_sessions.get(session_id)}
+        match = _SIMULATION_ACTION.match(path)
+        if match:
+            timer = Timer(self.simulation_seconds, self._finish_simulation,
+                          (int(match[1]),))
+            timer.daemon = True
+            timer.start()
+            return 200, {'data': 'started'}
+        if path == '/action/state_allocation/check':
+            return 200, {'data': [
+                {'type': 0, 'data': {'allocated': True}},
+                {'type': 1, 'data': {'allocated': True}},
+            ]}
+        if path == '/action/state_allocation/allocate':
+            uuid = body['data']['state_allocation_session_uuid']
+            timer = Timer(0.05, self.broadcast, (
+                'STATE_ALLOCATION_COMPLETED',
+                {'state_allocation_session_uuid': uuid}
+            ))
+            timer.daemon = True
+            timer.start()
+            return 200, {'data': {}}
+
+        if _ORDER_SUPPLY.match(path):
+            return 200, {'data': {}}
+        if _REPORT.match(path):
+            with self._lock:
+                self._report_probes += 1
+                not_ready = self._report_probes <= self.report_not_ready
+            if not_ready:
+                return 200, {'errors': [
+                    {'name': 'STATIC_REPORT_HAS_NOT_BEEN_PROCEED_YET'}
+                ]}
+            start = int(query.get('start', ['0'])[0])
+            stop = min(int(query.get('stop', ['1'])[0]), self.report_rows)
+            indexes = range(start, stop)
+            return 200, {
+                'meta': {'count': self.report_rows},
+                'data': [
+                    {'id': index, 'order_id': index % 50,
+                     'entity_id': index % 200, 'department_id': index % 5,
+                     'amount': index * 1.5}
+                    for index in indexes
+                ],
+                'order': [{'id': i % 50} for i in indexes],
+                'entity': [{'id': i % 200} for i in indexes],
+                'department': [{'id': i % 5} for i in indexes],
+            }
+        if path == '/action/upload':
+            self.uploaded_bytes += len(body or b'')
+            return 200, {'data': f'upload/{len(body or b"")}'}
+        if _IMPORT_STATUS.match(path):
+            if method == 'POST':
+                return 200, {'data': {
+                    'import_session_id': next(self._session_ids)
+                }}
+            return 400, {}
+        return 404, {'errors': [{'name': 'NOT_FOUND'}]}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    bfg = None
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _answer(self, method):
+        parts = urlsplit(self.path)
+        path = '/' + parts.path.lstrip('/')
+        if path == '/message' and \
+                self.headers.get('Upgrade', '').lower() == 'websocket':
+            return self._websocket()
+
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            raw = self._read_chunked()
+        else:
+            length = int(self.headers.get('Content-Length') or 0)
+            raw = self.rfile.read(length) if length else b''
+        wire_bytes = len(raw)
+        if self.headers.get('Content-Encoding') == 'gzip':
+            raw = gzip.decompress(raw)
+        if self.headers.get('Content-Type', '').startswith('multipart/'):
+            body = raw
+        else:
+            try:
+                body = json.loads(raw) if raw else None
+            except ValueError:
+                body = None
+
+        bfg = self.bfg
+        with bfg._lock:
+            bfg.requests += 1
+            if path == '/action/upload':
+                bfg.uploads.append({
+                    'headers': dict(self.headers),
+                    'wire_bytes': wire_bytes,
+                    'body': raw,
+                })
+        if bfg.latency:
+            time.sleep(bfg.latency)
+        status, answer = bfg.handle(method, path, parse_qs(parts.query),
+                                    body)
+        payload = json.dumps(answer).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        if path == '/action/login':
+            self.send_header('Set-Cookie', 'sid=bench; Path=/')
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _read_chunked(self):
+        chunks = []
+        while True:
+            size = int(self.rfile.readline().split(b';')[0], 16)
+            if not size:
+                self.rfile.readline()
+                return b''.join(chunks)
+            chunks.append(self.rfile.read(size))
+            self.rfile.readline()
+
+    def _websocket(self):
+        accept = base64.b64encode(hashlib.sha1(
+            (self.headers['Sec-WebSocket-Key'] + _WS_GUID).encode('ascii')
+        ).digest()).decode('ascii')
+        self.send_response(101)
+        self.send_header('Upgrade', 'websocket')
+        self.send_header('Connection', 'Upgrade')
+        self.send_header('Sec-WebSocket-Accept', accept)
+        self.end_headers()
+        self.wfile.flush()
+        with self.bfg._lock:
+            self.bfg._sockets.append(self.connection)
+        try:
+            while self.rfile.read(1):
+                pass
+        except OSError:
+            pass
+        finally:
+            with self.bfg._lock:
+                if self.connection in self.bfg._sockets:
+                    self.bfg._sockets.remove(self.connection)
+        self.close_connection = True
+
+    def do_GET(self):
+        self._answer('GET')
+
+    def do_POST(self):
+        self._answer('POST')
+
+    def do_PUT(self):
+        self._answer('PUT')
+
+    def do_DELETE(self):
+        self._answer('DELETE')
@@ -0,0 +1,128 @@
+"""
+Benchmarks of the IARest hot paths against the local FakeBFG server.
+
+    python -m bench.run --rows 200000 --latency 0.05 --workers 1 4 8
+"""
+import os
+import sys
+import time
+import tracemalloc
+from argparse import ArgumentParser
+from tempfile import TemporaryDirectory
+from threading import Thread
+
+import yaml
+
+from bench.fake_bfg import FakeBFG
+from ia_rest.iarest import IARest
+
+
+def _measure(func):
+    """Returns (result, seconds, peak traced bytes) of a second, traced call."""
+    started = time.perf_counter()
+    result = func()
+    seconds = time.perf_counter() - started
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, seconds, peak
+
+
+def _report(name, rows, seconds, peak):
+    print(f'{name:<45} {rows:>10} rows {seconds:>8.2f} s '
+          f'{rows / seconds if seconds else 0:>12.0f} rows/s '
+          f'{peak / 2 ** 20:>9.1f} MiB peak')
+
+
+def bench_collection(bfg, page_size, workers):
+    def fetch():
+        with IARest.from_config(bfg.config(page_size=page_size,
+                                           workers=workers)) as ia:
+            return len(ia.get_from_rest_collection('specification_item'))
+
+    rows, seconds, peak = _measure(fetch)
+    _report(f'get_from_rest_collection workers={workers}',
+            rows, seconds, peak)
+
+
+def bench_trafficlight(bfg, page_size, workers):
+    def fetch():
+        with IARest.from_config(bfg.config(page_size=page_size,
+                                           workers=workers)) as ia:
+            return len(ia.get_trafficlight_data(1, None, 'to')['data'])
+
+    rows, seconds, peak = _measure(fetch)
+    _report(f'get_trafficlight_data workers={workers}', rows, seconds, peak)
+
+
+def bench_detection(bfg, timeout=30):
+    """
+    Time from a primary session change on the server until main.py has run
+    the scripts and stored the new session, for the cron path and the
+    daemon path.
+    """
+    import main
+
+    with TemporaryDirectory() as directory:
+        config_path = os.path.join(directory, 'config.yml')
+        session_path = os.path.join(directory, 'session.yml')
+        with open(config_path, 'w', encoding='utf-8') as stream:
+            yaml.dump({
+                'IA': bfg.config(),
+                'scripts': [f'"{sys.executable}" -c ""'],
+                'daemon': {'poll_interval': 600},
+            }, stream)
+
+        def wait_for(session):
+            deadline = time.perf_counter() + timeout
+            while time.perf_counter() < deadline:
+                if main.read_session_from_yml(session_path) == session:
+                    return time.perf_counter()
+                time.sleep(0.01)
+            raise TimeoutError(session)
+
+        main.save_session_to_yml(bfg.primary_session, session_path)
+
+        bfg.set_primary(bfg.primary_session + 1)
+        started = time.perf_counter()
+        main.start_script(session_path, config_path)
+        print(f'{"start_script (cron run, change present)":<45} '
+              f'{time.perf_counter() - started:>8.2f} s')
+
+        started = time.perf_counter()
+        main.start_script(session_path, config_path)
+        print(f'{"start_script (cron run, no change)":<45} '
+              f'{time.perf_counter() - started:>8.2f} s')
+
+        Thread(target=main.watch, args=(session_path, config_path),
+               daemon=True).start()
+        time.sleep(1)
+        bfg.set_primary(bfg.primary_session + 1)
+        started = time.perf_counter()
+        finished = wait_for(bfg.primary_session)
+        print(f'{"--daemon detection latency":<45} '
+              f'{finished - started:>8.2f} s')
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Бенчмарк клиента IARest '
+                                        'на локальном сервере FakeBFG')
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--row-width', type=int, default=8)
+    parser.add_argument('--page-size', type=int, default=10000)
+    parser.add_argument('--latency', type=float, default=0.02)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 4])
+    parser.add_argument('--skip-detection', action='store_true')
+    args = parser.parse_args()
+
+    with FakeBFG(rows=args.rows, row_width=args.row_width,
+                 latency=args.latency) as bfg:
+        for workers in args.workers:
+            bench_collection(bfg, args.page_size, workers)
+        for workers in args.workers:
+            bench_trafficlight(bfg, args.page_size, workers)
+        if not args.skip_detection:
+            bench_detection(bfg)
@@ -0,0 +1,133 @@
+"""
+Start-up cost of the cron check (the "no new session" path) against the
+local FakeBFG server: import time of main.py and the time from process
+start to the decision, cold (no bytecode cache, no saved credentials) and
+warm (both in place).
+
+    python -m bench.startup --runs 5
+    python -m bench.startup --binary dist/linux/start_if_new_session
+
+With --binary the decision is timed for the PyInstaller build (for onefile
+its first run also unpacks the bundle); import times are always measured
+for the sources.
+"""
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+from argparse import ArgumentParser
+from tempfile import TemporaryDirectory
+
+import yaml
+
+from bench.fake_bfg import FakeBFG
+
+_PROJECT_DIRPATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_IMPORT_TIME = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)$')
+
+_HEAVY_MODULES = ('tqdm', 'websocket', 'pytz', 'yaml', 'requests')
+
+
+def _environment(pycache):
+    environment = dict(os.environ, PYTHONPYCACHEPREFIX=pycache)
+    environment.pop('PYTHONDONTWRITEBYTECODE', None)
+    return environment
+
+
+def import_profile(pycache):
+    """Returns (total seconds, {top-level module: seconds}) for import main."""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import main'],
+        cwd=_PROJECT_DIRPATH, env=_environment(pycache),
+        stderr=subprocess.PIPE, stdout=subprocess.DEVNULL,
+        universal_newlines=True, check=True
+    )
+    modules = {}
+    total = 0
+    for line in result.stderr.splitlines():
+        match = _IMPORT_TIME.match(line)
+        if not match:
+            continue
+        cumulative, indent, name = int(match[2]), len(match[3]), match[4]
+        if name == 'main':
+            total = cumulative
+        elif indent <= 3 or name in _HEAVY_MODULES:
+            modules[name] = max(modules.get(name, 0), cumulative)
+    return total / 1e6, {name: value / 1e6 for name, value in modules.items()}
+
+
+def time_to_decision(command, pycache):
+    started = time.perf_counter()
+    result = subprocess.run(
+        command, cwd=_PROJECT_DIRPATH, env=_environment(pycache),
+        stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+        universal_newlines=True
+    )
+    seconds = time.perf_counter() - started
+    if 'Новой сессии не появилось' not in result.stdout:
+        raise RuntimeError(result.stdout)
+    return seconds
+
+
+def _report(name, values):
+    print(f'{name:<40} median {statistics.median(values) * 1000:>8.1f} ms '
+          f'min {min(values) * 1000:>8.1f} ms')
+
+
+def main(runs, binary=None, latency=0.0):
+    with FakeBFG(latency=latency) as bfg, TemporaryDirectory() as directory:
+        config_path = os.path.join(directory, 'config.yml')
+        session_path = os.path.join(directory, 'session.yml')
+        credentials_path = os.path.join(directory, 'credentials.json')
+        with open(config_path, 'w', encoding='utf-8') as stream:
+            yaml.dump({
+                'IA': bfg.config(credentials=credentials_path),
+                'scripts': ['true'],
+            }, stream)
+        with open(session_path, 'w', encoding='utf-8') as stream:
+            yaml.dump({'session': bfg.primary_session}, stream)
+
+        if binary is None:
+            command = [sys.executable, 'main.py']
+        else:
+            command = [os.path.abspath(binary)]
+        command += ['-c', config_path, '-s', session_path]
+
+        cold_imports, cold_decisions = [], []
+        warm_imports, warm_decisions = [], []
+        modules = {}
+        for run in range(runs):
+            decision_cache = os.path.join(directory, f'pycache-{run}')
+            import_cache = os.path.join(directory, f'pycache-{run}-imports')
+            if os.path.exists(credentials_path):
+                os.remove(credentials_path)
+            cold_decisions.append(time_to_decision(command, decision_cache))
+            cold_imports.append(import_profile(import_cache)[0])
+            seconds, modules = import_profile(import_cache)
+            warm_imports.append(seconds)
+            warm_decisions.append(time_to_decision(command, decision_cache))
+
+        _report('import main (cold)', cold_imports)
+        _report('import main (warm)', warm_imports)
+        _report('time to decision (cold)', cold_decisions)
+        _report('time to decision (warm)', warm_decisions)
+        print('heaviest imports (warm):')
+        for name, seconds in sorted(modules.items(),
+                                    key=lambda item: -item[1])[:10]:
+            print(f'    {name:<36} {seconds * 1000:>8.1f} ms')
+        loaded = [name for name in _HEAVY_MODULES if name in modules]
+        print(f'loaded on the check path: {", ".join(loaded) or "-"}')
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Время запуска проверки главного '
+                                        'расчета на локальном сервере FakeBFG')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--binary', default=None,
+                        help='собранный PyInstaller файл вместо python main.py')
+    parser.add_argument('--latency', type=float, default=0.0)
+    args = parser.parse_args()
+    main(args.runs, args.binary, args.latency)
@@ -0,0 +1,663 @@
+import asyncio
+import random
+import time
+import uuid
+from collections import deque
+from contextlib import asynccontextmanager
+from functools import partialmethod
+from logging import DEBUG
+from urllib.parse import urljoin
+
+import aiohttp
+
+from base.base import Base
+from ia_rest.cache import CollectionCache
+from ia_rest.events import Subscription
+from ia_rest.index import IndexRegistry
+from ia_rest.iarest import IARest, _ALLOCATION_EVENTS, _AUTH_ERRORS, \
+    _COLLECTION_PAGE_SIZE, _REPORT_NOT_READY, _SIMULATION_EVENTS
+from ia_rest.jsonlib import get_loads
+from ia_rest.retention import RetentionPolicy, RetentionReport
+from ia_rest.table import CollectionTable
+from ia_rest.wait import Waiter
+
+__all__ = [
+    'AsyncIARest',
+]
+
+_RETRY_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS'])
+
+
+class _MessageSubscription(object):
+    """
+    Websocket messages of one AsyncIARest.subscribe that pass the filter of
+    events.Subscription; `wait` and `drain` mean the same as there.
+    """
+
+    def __init__(self, msgs=None, match=None):
+        self._filter = Subscription(None, msgs, match)
+        self._messages = deque()
+        self._arrived = asyncio.Event()
+
+    def put(self, message):
+        if self._filter.matches(message):
+            self._messages.append(message)
+            self._arrived.set()
+
+    async def wait(self, timeout=None):
+        try:
+            await asyncio.wait_for(self._arrived.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        self._arrived.clear()
+        return True
+
+    def drain(self):
+        messages = list(self._messages)
+        self._messages.clear()
+        return messages
+
+
+class AsyncIARest(Base):
+    """
+    asyncio counterpart of IARest built on aiohttp.
+
+    One instance keeps one aiohttp.ClientSession; several instances may
+    share a connector (and so a connection pool) through `connector`.
+    It is configured from the same IA section as IARest.
+    """
+
+    def __init__(self, login, password, base_url, ws_url,
+                 *args, page_size=_COLLECTION_PAGE_SIZE, workers=1,
+                 disk_cache=None, connector=None, pool_size=10,
+                 retries=3, backoff_factor=0.5, backoff_jitter=0.5,
+                 backoff_max=30, status_forcelist=(502, 503, 504),
+                 timeout=(10, 300), json_loads=None, as_table=False,
+                 waiter=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._base_url = base_url
+        self._login = login
+        self._password = password
+        self.ws_url = ws_url
+
+        self.page_size = page_size
+        self.workers = workers
+        self.as_table = as_table
+
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.backoff_jitter = backoff_jitter
+        self.backoff_max = backoff_max
+        self.status_forcelist = frozenset(status_forcelist)
+
+        self._connector = connector
+        self._pool_size = pool_size
+        self._timeout = timeout
+        self._http = None
+
+        self._user = None
+        self._login_generation = 0
+        self._login_lock = None
+
+        self._json_loads = json_loads or get_loads()
+        self.waiter = waiter or Waiter()
+
+        self.cache = {}
+        self.indexes = IndexRegistry()
+        self.disk_cache = disk_cache
+        self._primary_session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    async def close(self):
+        if self._http is not None:
+            await self._http.close()
+            self._http = None
+
+    @property
+    def http(self):
+        if self._http is None:
+            connect, read = self._timeout if isinstance(
+                self._timeout, (list, tuple)
+            ) else (self._timeout, self._timeout)
+            self._http = aiohttp.ClientSession(
+                connector=self._connector or aiohttp.TCPConnector(
+                    limit=self._pool_size,
+                    ssl=False
+                ),
+                connector_owner=self._connector is None,
+                timeout=aiohttp.ClientTimeout(
+                    sock_connect=connect,
+                    sock_read=read
+                ),
+                headers={'Accept-Encoding': 'gzip, deflate'},
+            )
+        return self._http
+
+    @property
+    def login_lock(self):
+        if self._login_lock is None:
+            self._login_lock = asyncio.Lock()
+        return self._login_lock
+
+    def _make_url(self, uri):
+        return urljoin(self._base_url, uri)
+
+    def _backoff(self, attempt):
+        return min(
+            self.backoff_max,
+            self.backoff_factor * 2 ** attempt
+        ) + random.uniform(0, self.backoff_jitter)
+
+    @staticmethod
+    def _is_auth_error(status, response_json):
+        if status == 401:
+            return True
+        if status < 400 or not isinstance(response_json, dict):
+            return False
+        return any(
+            isinstance(error, dict) and error.get('name') in _AUTH_ERRORS
+            for error in response_json.get('errors') or []
+        )
+
+    async def _perform_json_request(self, http_method, uri, *,
+                                    authenticate=True, **kwargs):
+        url = self._make_url(uri)
+        logger = self._logger
+
+        if logger.isEnabledFor(DEBUG):
+            logger.debug('Выполнение {} запроса '
+                         'по ссылке {!r}.'.format(http_method, url))
+
+        if authenticate:
+            await self._ensure_login()
+        relogged = not authenticate
+        attempt = 0
+        while True:
+            generation = self._login_generation
+            try:
+                async with self.http.request(http_method, url,
+                                             **kwargs) as response:
+                    status = response.status
+                    body = await response.read()
+            except (aiohttp.ClientConnectionError,
+                    asyncio.TimeoutError) as error:
+                if http_method not in _RETRY_METHODS or \
+                        attempt >= self.retries:
+                    raise
+                logger.info('Ошибка соединения {!r}, '
+                            'повтор запроса {!r}.'.format(error, url))
+                await asyncio.sleep(self._backoff(attempt))
+                attempt += 1
+                continue
+
+            # the body of a retried gateway error is often an HTML page,
+            # so it is decoded only once the response is kept
+            if status in self.status_forcelist and \
+                    http_method in _RETRY_METHODS and \
+                    attempt < self.retries:
+                logger.info('Ответ {}, повтор запроса {!r}.'.format(
+                    status, url
+                ))
+                await asyncio.sleep(self._backoff(attempt))
+                attempt += 1
+                continue
+            response_json = self._json_loads(body)
+            if not relogged and self._is_auth_error(status, response_json):
+                relogged = True
+                await self._relogin(generation)
+                continue
+            return response_json
+
+    _perform_get = partialmethod(_perform_json_request, 'GET')
+    _perform_delete = partialmethod(_perform_json_request, 'DELETE')
+
+    async def _perform_post(self, uri, data):
+        return await self._perform_json_request('POST', uri, json=data)
+
+    async def _perform_action(self, uri_part, **data):
+        return await self._perform_post(
+            '/action/{}'.format(uri_part),
+            data=data
+        )
+
+    async def _perform_login(self):
+        async with self.login_lock:
+            await self._login_unlocked()
+        return self._user
+
+    async def _login_unlocked(self):
+        self._user = (await self._perform_json_request(
+            'POST',
+            '/action/login',
+            authenticate=False,
+            json={
+                'data': {
+                    'login': self._login,
+                    'password': self._password
+                },
+                'action': 'login'
+            }
+        ))['data']
+        self._login_generation += 1
+
+    async def _ensure_login(self):
+        if self._user is not None:
+            return
+        async with self.login_lock:
+            if self._user is None:
+                await self._login_unlocked()
+
+    async def _relogin(self, generation):
+        async with self.login_lock:
+            if self._login_generation == generation:
+                self.http.cookie_jar.clear()
+                await self._login_unlocked()
+
+    async def current_user(self):
+        await self._ensure_login()
+        return self._user
+
+    async def _get_main_session(self):
+        self._primary_session = (await self._perform_get(
+            'action/primary_simulation_session'
+        ))['data']
+        return self._primary_session
+
+    async def _cache_session(self):
+        if self._primary_session is None:
+            await self._get_main_session()
+        return self._primary_session
+
+    async def _iter_concurrent(self, func, args, workers):
+        pending = deque()
+        try:
+            for arg in args:
+                pending.append(asyncio.ensure_future(func(arg)))
+                if len(pending) >= max(1, workers):
+                    yield await pending.popleft()
+            while pending:
+                yield await pending.popleft()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def iter_rest_collection(self, table, filter=None, page_size=None,
+                                   workers=None, batches=False):
+        page_size = page_size or self.page_size
+        workers = workers or self.workers
+
+        def fetch(start):
+            return self._perform_get(IARest._collection_uri(
+                table, start, start + page_size, filter
+            ))
+
+        page = await fetch(0)
+        starts = range(page_size, page['meta']['count'], page_size)
+        pages = self._iter_concurrent(fetch, starts, workers)
+        while table in page:
+            if batches:
+                yield page[table]
+            else:
+                for row in page[table]:
+                    yield row
+            try:
+                page = await pages.__anext__()
+            except StopAsyncIteration:
+                return
+
+    async def get_from_rest_collection(self, table, filter=None,
+                                       page_size=None, workers=None,
+                                       as_table=None):
+        if as_table is None:
+            as_table = self.as_table
+        if filter is None and table in self.cache:
+            return IARest._as_requested(self.cache[table], as_table)
+        if self.disk_cache is not None:
+            result = self.disk_cache.get(table, filter,
+                                         await self._cache_session())
+            if result is not None:
+                if filter is None:
+                    self.cache[table] = result
+                return IARest._as_requested(result, as_table)
+
+        result = CollectionTable(name=table) if as_table else []
+        async for rows in self.iter_rest_collection(
+                table, filter, page_size, workers, batches=True):
+            result += rows
+        if filter is None:
+            self.cache[table] = result
+        if self.disk_cache is not None:
+            self.disk_cache.put(table, result, filter,
+                                await self._cache_session())
+        return result
+
+    async def index(self, table, *fields, unique=False):
+        """Same as IARest.index."""
+        if table not in self.cache:
+            await self.get_from_rest_collection(table)
+        return self.indexes.get(table, self.cache[table], fields, unique)
+
+    def connect_messages(self):
+        return self.http.ws_connect(f'{self.ws_url}/message', ssl=False)
+
+    @asynccontextmanager
+    async def subscribe(self, msgs=None, **match):
+        """
+        Collects the matching websocket messages while the block runs. The
+        socket is open once this returns, so an action taken inside the
+        block cannot outrun its event; without a connection the
+        subscription stays empty and the waits rely on polling.
+        """
+        subscription = _MessageSubscription(msgs, match)
+        try:
+            ws = await self.connect_messages()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+            self._logger.warning(
+                f'Нет соединения с websocket: {error!r}, события могут быть '
+                f'пропущены'
+            )
+            ws = None
+        if ws is None:
+            yield subscription
+            return
+
+        async def read():
+            async for ws_message in ws:
+                if ws_message.type != aiohttp.WSMsgType.TEXT:
+                    continue
+                try:
+                    message = self._json_loads(ws_message.data)
+                except ValueError:
+                    continue
+                if isinstance(message, dict):
+                    subscription.put(message)
+
+        reader = asyncio.ensure_future(read())
+        try:
+            yield subscription
+        finally:
+            reader.cancel()
+            await ws.close()
+
+    async def _check_allocation(self, plan_id):
+        return (await self._perform_action(
+            'state_allocation/check',
+            data={
+                'plan_id': plan_id,
+                'allocation_types': [{'type': 1}, {'type': 0}]
+            }
+        ))['data']
+
+    async def _wait_allocation(self, subscription, plan_id, allocation_uuid,
+                               before, timeout):
+        """Same as IARest._wait_allocation."""
+        async def check():
+            for message in subscription.drain():
+                outcome = IARest._allocation_outcome(message,
+                                                     allocation_uuid)
+                if outcome == 'failed':
+                    raise RuntimeError(
+                        f'Распределение состояния не выполнено: {message}'
+                    )
+                if outcome == 'completed':
+                    return message
+            if await self._check_allocation(plan_id) != before:
+                return {'msg': 'STATE_ALLOCATION_CHECK_CHANGED'}
+            return None
+
+        try:
+            return await self.waiter.apoll(
+                check, 'state_allocation', timeout=timeout,
+                subscription=subscription, initial=1, max_interval=10
+            )
+        except TimeoutError:
+            raise RuntimeError(
+                f'Распределение состояния не завершилось за {timeout} с'
+            ) from None
+
+    async def start_simulation(self, plan_id, equipment_variation_id,
+                               employee_variation_id,
+                               entity_batch_variation_id,
+                               simulation_settings_id,
+                               equipment_amount_variation_id,
+                               sim_period=None,
+                               start_time=3, allocation_timeout=600):
+        user_id = (await self.current_user())['id']
+        before = await self._check_allocation(plan_id)
+        types = IARest._allocation_types(before)
+        wip_allocation_uuid = str(uuid.uuid4())
+        async with self.subscribe(
+                _ALLOCATION_EVENTS,
+                state_allocation_session_uuid=wip_allocation_uuid
+        ) as allocation:
+            await self._perform_action(
+                'state_allocation/allocate',
+                data={
+                    'state_allocation_session_uuid': wip_allocation_uuid,
+                    'plan_id': plan_id,
+                    'allocation_types': [
+                        {'type': each_type} for each_type in types
+                    ],
+                }
+            )
+            await self._wait_allocation(allocation, plan_id,
+                                        wip_allocation_uuid, before,
+                                        allocation_timeout)
+
+        simulation_session_id = (await self._perform_post(
+            'rest/simulation_session',
+            data=IARest._simulation_session_data(
+                plan_id, equipment_variation_id, employee_variation_id,
+                entity_batch_variation_id, simulation_settings_id,
+                equipment_amount_variation_id, user_id,
+                sim_period, start_time
+            )
+        ))['simulation_session']['id']
+
+        self._logger.info(
+            await self._perform_post(
+                f'action/simulation/{simulation_session_id}',
+                data={'action': 'start'}
+            )
+        )
+        return simulation_session_id
+
+    async def clean_sessions(self, number=None, dry_run=False, **policy):
+        """
+        Same as IARest.clean_sessions: deletes the simulation sessions not
+        kept by RetentionPolicy(keep_last=number, **policy), `workers` at a
+        time; the primary and the running ones survive.
+        """
+        started = time.perf_counter()
+        policy = RetentionPolicy(keep_last=number, **policy)
+        if not dry_run:
+            policy.ensure_keeps()
+        sessions = []
+        async for rows in self.iter_rest_collection('simulation_session',
+                                                    batches=True):
+            sessions += rows
+        kept, deleted = policy.split(sessions,
+                                     await self._get_main_session())
+        if dry_run:
+            self._logger.info('Будут удалены расчеты ({}): {}'.format(
+                len(deleted), ', '.join(str(row['id']) for row in deleted)
+            ))
+            return RetentionReport(len(kept), len(deleted), 0,
+                                   time.perf_counter() - started, True)
+
+        semaphore = asyncio.Semaphore(max(1, self.workers))
+
+        async def delete(simulation_session_id):
+            async with semaphore:
+                try:
+                    answer = await self.delete_simulation(
+                        simulation_session_id
+                    )
+                except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+                    answer = {'errors': repr(error)}
+            if isinstance(answer, dict) and answer.get('errors'):
+                self._logger.warning(
+                    f'Не удалось удалить расчет {simulation_session_id}: '
+                    f'{answer["errors"]!r}'
+                )
+                return False
+            return True
+
+        done = await asyncio.gather(*(
+            delete(row['id']) for row in deleted
+        ))
+        failed = done.count(False)
+        report = RetentionReport(len(kept), len(deleted) - failed, failed,
+                                 time.perf_counter() - started, False)
+        self._logger.info(
+            'Удалено расчетов: {}, не удалось: {}, оставлено: {}'.format(
+                report.deleted, report.failed, report.kept
+            )
+        )
+        return report
+
+    async def delete_simulation(self, simulation_session_id: int) -> dict:
+        return await self._perform_delete(
+            f'rest/simulation_session/{simulation_session_id}'
+        )
+
+    async def _simulation_status(self, simulation_session_id):
+        simulation_session = (await self._perform_get(
+            f'rest/simulation_session/{simulation_session_id}'
+        )).get('simulation_session')
+        if simulation_session is None:
+            raise LookupError(
+                f'Расчет {simulation_session_id} не найден на сервере'
+            )
+        return simulation_session['status']
+
+    async def accept_simulation(self, simulation_session_id: int,
+                                accept=True, poll_interval=300,
+                                timeout=None):
+        """Same as IARest.accept_simulation."""
+        self._logger.info('Ожидаем завершения расчета')
+        async with self.subscribe(
+                _SIMULATION_EVENTS,
+                simulation_session_id=simulation_session_id
+        ) as finished:
+            result = await self.waiter.apoll(
+                lambda: self._simulation_status(simulation_session_id),
+                'simulation', timeout=timeout, subscription=finished,
+                initial=min(30, poll_interval), max_interval=poll_interval
+            )
+        self._logger.info('Расчет завершен')
+
+        if result == 0 and accept:
+            await self._perform_action(
+                'primary_simulation_session',
+                data={
+                    'simulation_session_id': simulation_session_id,
+                    'cleanup': False
+                }
+            )
+            self._logger.info('Расчет принят')
+        else:
+            self._logger.info(f'Расчет завершился со статусом {result}')
+        return result
+
+    async def _resolve_trafficlight_filter(self, session_id, department_id,
+                                           direction):
+        if session_id is None:
+            sessions = await self.get_from_rest_collection('static_session')
+            session_id = 0
+            for row in sessions:
+                if row['type'] == 2:
+                    session_id = max(session_id, row['id'])
+            self._logger.info(f"Сессия расчета {session_id}")
+        await self._perform_get(
+            f"/data/static_result/{session_id}/consolidated/order_supply?offload=true"
+        )
+        await asyncio.sleep(2)
+        if department_id is None:
+            return session_id, None
+        department = (await self.index('department', 'identity')).lookup(
+            department_id
+        )
+        if department is None:
+            return session_id, None
+        return session_id, f"{direction}_department_id eq {department['id']}"
+
+    async def _probe_trafficlight_report(self, session_id, filter=None):
+        """Same as IARest._probe_trafficlight_report."""
+        result = await self._perform_get(
+            IARest._trafficlight_uri(session_id, 0, 1, filter)
+        )
+        if 'errors' in result:
+            self._logger.info(str(result))
+            if result['errors'][0].get('name') not in _REPORT_NOT_READY:
+                raise RuntimeError(f'Отчет не получен: {result["errors"]}')
+            return None
+        if type(result.get('data')) == str or not result.get('meta'):
+            return None
+        return result
+
+    async def _wait_for_trafficlight_report(self, session_id, filter=None,
+                                            timeout=None):
+        return await self.waiter.apoll(
+            lambda: self._probe_trafficlight_report(session_id, filter),
+            'static_report', timeout=timeout, initial=5, max_interval=120,
+            on_retry=lambda result, delay: self._logger.info(
+                f'Отчет еще не готов, повтор через {delay:.1f} с'
+            )
+        )
+
+    async def iter_trafficlight_data(self, session_id, department_id,
+                                     direction, page_size=None,
+                                     workers=None):
+        page_size = page_size or self.page_size
+        workers = workers or self.workers
+        session_id, filter = await self._resolve_trafficlight_filter(
+            session_id, department_id, direction
+        )
+        first = await self._wait_for_trafficlight_report(session_id, filter)
+        yield first
+
+        async for page in self._iter_concurrent(
+                lambda start: self._perform_get(IARest._trafficlight_uri(
+                    session_id, start, start + page_size, filter
+                )),
+                range(1, first['meta']['count'], page_size),
+                workers):
+            yield page
+
+    async def get_trafficlight_data(self, session_id, department_id,
+                                    direction, page_size=None, workers=None):
+        pages = []
+        async for page in self.iter_trafficlight_data(
+                session_id, department_id, direction, page_size, workers):
+            pages.append(page)
+        return IARest._merge_report_pages(pages)
+
+    @classmethod
+    def from_config(cls, config, connector=None):
+        workers = config.get('workers', 1)
+        transport = dict(config.get('transport') or {})
+        transport.setdefault('pool_size', max(10, workers))
+        return cls(
+            config['login'],
+            config['password'],
+            config['url'],
+            config['ws_url'],
+            page_size=config.get('page_size', _COLLECTION_PAGE_SIZE),
+            workers=workers,
+            disk_cache=CollectionCache.from_config(
+                config['cache'], namespace=config['url']
+            ) if 'cache' in config else None,
+            connector=connector,
+            json_loads=get_loads(config.get('json')),
+            as_table=config.get('as_table', False),
+            waiter=Waiter.from_config(
+                config['wait']
+            ) if 'wait' in config else None,
+            **transport
+        )
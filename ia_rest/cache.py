@@ -0,0 +1,155 @@
+import hashlib
+import os
+import pickle
+import struct
+import time
+import zlib
+from tempfile import mkstemp
+
+from base.base import Base
+
+__all__ = [
+    'CollectionCache',
+]
+
+_MAGIC = b'IAC1'
+_HEADER = struct.Struct('<4sdq')
+_NO_SESSION = -1
+_SUFFIX = '.bin'
+
+
+class CollectionCache(Base):
+    """
+    On-disk cache of collection snapshots.
+
+    Every entry is a single file: a fixed header (magic, creation time,
+    primary session id) followed by the zlib-compressed pickle of the rows.
+    Entries are dropped when they outlive `ttl` seconds or were written for
+    another primary session; the least recently used ones are evicted once
+    the directory grows over `max_bytes`.
+    """
+
+    def __init__(self, path, max_bytes=1 << 30, ttl=24 * 60 * 60,
+                 compresslevel=6, namespace='', *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._path = path
+        self.namespace = namespace
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.compresslevel = compresslevel
+        os.makedirs(path, exist_ok=True)
+
+    def make_key(self, table, filter=None):
+        """
+        The filter is hashed as given (Query.cache_filter is already
+        normalized): collapsing its whitespace would merge quoted literals
+        that differ in spacing.
+        """
+        return hashlib.sha1(
+            f'{self.namespace}\0{table}\0{filter or ""}'.encode('utf-8')
+        ).hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self._path, key + _SUFFIX)
+
+    @staticmethod
+    def _session_id(session):
+        return _NO_SESSION if session is None else int(session)
+
+    def _read_header(self, path):
+        with open(path, 'rb') as f:
+            magic, created, session = _HEADER.unpack(
+                f.read(_HEADER.size)
+            )
+        if magic != _MAGIC:
+            raise ValueError(path)
+        return created, session
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def get(self, table, filter=None, session=None):
+        path = self._entry_path(self.make_key(table, filter))
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            magic, created, stored_session = _HEADER.unpack_from(data)
+            if magic != _MAGIC:
+                raise ValueError(path)
+        except FileNotFoundError:
+            return None
+        except (ValueError, struct.error):
+            self._remove(path)
+            return None
+
+        if time.time() - created > self.ttl or \
+                stored_session != self._session_id(session):
+            self._remove(path)
+            return None
+
+        try:
+            rows = pickle.loads(zlib.decompress(data[_HEADER.size:]))
+        except (zlib.error, pickle.UnpicklingError, EOFError):
+            self._remove(path)
+            return None
+        os.utime(path)
+        self._logger.debug(
+            'Таблица {} получена из кэша {!r}.'.format(table, path)
+        )
+        return rows
+
+    def put(self, table, rows, filter=None, session=None):
+        path = self._entry_path(self.make_key(table, filter))
+        fd, tmp_path = mkstemp(dir=self._path, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(_HEADER.pack(
+                _MAGIC, time.time(), self._session_id(session)
+            ))
+            f.write(zlib.compress(
+                pickle.dumps(rows, protocol=pickle.HIGHEST_PROTOCOL),
+                self.compresslevel
+            ))
+        os.replace(tmp_path, path)
+        self.evict()
+
+    def evict(self):
+        now = time.time()
+        entries = []
+        for name in os.listdir(self._path):
+            if not name.endswith(_SUFFIX):
+                continue
+            path = os.path.join(self._path, name)
+            try:
+                created, _ = self._read_header(path)
+                stat = os.stat(path)
+            except (OSError, ValueError, struct.error):
+                self._remove(path)
+                continue
+            if now - created > self.ttl:
+                self._remove(path)
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            self._remove(path)
+            total -= size
+
+    def clear(self):
+        for name in os.listdir(self._path):
+            if name.endswith(_SUFFIX):
+                self._remove(os.path.join(self._path, name))
+
+    @classmethod
+    def from_config(cls, config, namespace=''):
+        return cls(
+            config['path'],
+            max_bytes=config.get('max_bytes', 1 << 30),
+            ttl=config.get('ttl', 24 * 60 * 60),
+            namespace=namespace,
+        )
@@ -0,0 +1,104 @@
+import json
+import os
+import time
+from tempfile import mkstemp
+from threading import Lock
+
+from base.base import Base
+
+__all__ = [
+    'CredentialStore',
+]
+
+_COOKIE_FIELDS = ('name', 'value', 'domain', 'path', 'expires', 'secure')
+
+
+class CredentialStore(Base):
+    """
+    Keeps authenticated cookies and the logged in user between runs.
+
+    The file is readable by its owner only and never contains the password.
+    Entries are keyed by login and server url and are ignored once they are
+    older than `max_age` seconds or all their cookies have expired.
+    """
+
+    _write_lock = Lock()
+
+    def __init__(self, path, max_age=12 * 60 * 60, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.path = os.path.expanduser(path)
+        self.max_age = max_age
+
+    @staticmethod
+    def _make_key(login, base_url):
+        return f'{login}@{base_url}'
+
+    def _read(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as stream:
+                return json.load(stream)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def _write(self, data):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        fd, tmp_path = mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as stream:
+            json.dump(data, stream)
+        os.replace(tmp_path, self.path)
+
+    def load(self, login, base_url, cookie_jar):
+        """
+        Puts the stored cookies into `cookie_jar` and returns the stored
+        user, or None when there is nothing usable.
+        """
+        entry = self._read().get(self._make_key(login, base_url))
+        if not entry or time.time() - entry['saved_at'] > self.max_age:
+            return None
+        now = time.time()
+        cookies = [
+            cookie for cookie in entry['cookies']
+            if cookie['expires'] is None or cookie['expires'] > now
+        ]
+        if not cookies:
+            return None
+        for cookie in cookies:
+            cookie_jar.set(
+                cookie['name'],
+                cookie['value'],
+                domain=cookie['domain'],
+                path=cookie['path'],
+                expires=cookie['expires'],
+                secure=cookie['secure'],
+            )
+        return entry['user']
+
+    def save(self, login, base_url, cookie_jar, user):
+        with self._write_lock:
+            data = self._read()
+            data[self._make_key(login, base_url)] = {
+                'saved_at': time.time(),
+                'user': user,
+                'cookies': [
+                    {field: getattr(cookie, field)
+                     for field in _COOKIE_FIELDS}
+                    for cookie in cookie_jar
+                ],
+            }
+            self._write(data)
+
+    def forget(self, login, base_url):
+        with self._write_lock:
+            data = self._read()
+            if data.pop(self._make_key(login, base_url), None) is not None:
+                self._write(data)
+
+    @classmethod
+    def from_config(cls, config):
+        if isinstance(config, str):
+            return cls(config)
+        return cls(
+            config['path'],
+            max_age=config.get('max_age', 12 * 60 * 60),
+        )
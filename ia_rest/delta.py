@@ -0,0 +1,182 @@
+import hashlib
+import os
+import pickle
+import time
+import zlib
+from datetime import datetime, timezone
+from tempfile import mkstemp
+
+from base.base import Base
+
+__all__ = [
+    'DeltaSync',
+]
+
+_DATETIME_SIMPLE_FORMAT = '%Y-%m-%dT%H:%M:%S'
+_SUFFIX = '.snap'
+
+
+class DeltaSync(Base):
+    """
+    Keeps a local snapshot of whole collections and brings it up to date
+    with only the rows that changed since the previous sync.
+
+    By default a table is treated as append-only and the rows past the last
+    seen `id` are fetched. Tables listed in `changed_since` are queried by a
+    filter template instead (e.g. "updated_at gt '{since}'", `since` being
+    the UTC time of the previous sync minus `overlap` seconds) and merged
+    by id. Either way the merged snapshot is sorted the way a full fetch
+    orders the table (see IARest._collection_order), and its size is checked against meta.count of the
+    table and the table is downloaded in full when they differ (rows were
+    deleted, or changed without notice).
+
+    Delta sync is opt-in: only the tables listed in `tables` or
+    `changed_since` go through it, every other collection is fetched in
+    full. Tables whose rows have no `id` cannot be merged and are always
+    fetched in full as well.
+    """
+
+    def __init__(self, path, tables=None, changed_since=None, overlap=60,
+                 compresslevel=6, namespace='', *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._path = path
+        self.tables = frozenset(tables or ())
+        self.changed_since = dict(changed_since or {})
+        self.overlap = overlap
+        self.compresslevel = compresslevel
+        self.namespace = namespace
+        self._without_id = set()
+        os.makedirs(path, exist_ok=True)
+
+    def handles(self, table):
+        return table in self.tables or table in self.changed_since
+
+    def _snapshot_path(self, table):
+        return os.path.join(self._path, hashlib.sha1(
+            f'{self.namespace}\0{table}'.encode('utf-8')
+        ).hexdigest() + _SUFFIX)
+
+    def load(self, table):
+        try:
+            with open(self._snapshot_path(table), 'rb') as f:
+                return pickle.loads(zlib.decompress(f.read()))
+        except FileNotFoundError:
+            return None
+        except (zlib.error, pickle.UnpicklingError, EOFError, ValueError):
+            self.forget(table)
+            return None
+
+    def save(self, table, snapshot):
+        fd, tmp_path = mkstemp(dir=self._path, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(zlib.compress(
+                pickle.dumps(snapshot, protocol=pickle.HIGHEST_PROTOCOL),
+                self.compresslevel
+            ))
+        os.replace(tmp_path, self._snapshot_path(table))
+
+    def forget(self, table):
+        try:
+            os.remove(self._snapshot_path(table))
+        except FileNotFoundError:
+            pass
+
+    @staticmethod
+    def _fetch(rest, table, filter=None):
+        rows = []
+        for page in rest._iter_collection_pages(table, filter):
+            rows += page
+        return rows
+
+    @staticmethod
+    def _sort(rows, fields):
+        # nulls last, as the server orders them
+        rows.sort(key=lambda row: tuple(
+            (row.get(field) is None, row.get(field)) for field in fields
+        ))
+        return rows
+
+    @staticmethod
+    def _merge(rows, changed):
+        positions = {row['id']: position for position, row in enumerate(rows)}
+        for row in changed:
+            position = positions.get(row['id'])
+            if position is None:
+                positions[row['id']] = len(rows)
+                rows.append(row)
+            else:
+                rows[position] = row
+        return rows
+
+    def _store(self, table, rows, synced_at):
+        if any('id' not in row for row in rows):
+            self._logger.warning(
+                f'В таблице {table} у строк нет id, она будет загружаться '
+                f'полностью'
+            )
+            self._without_id.add(table)
+            self.forget(table)
+            return rows
+        self.save(table, {
+            'rows': rows,
+            'last_id': max((row['id'] for row in rows), default=0),
+            'synced_at': synced_at,
+        })
+        return rows
+
+    def _resync(self, rest, table, synced_at, reason, message):
+        self._logger.info(
+            'Таблица {} загружается полностью: {}'.format(table, message)
+        )
+        rest.metrics.inc('delta_resyncs_total', table=table, reason=reason)
+        return self._store(table, self._fetch(rest, table), synced_at)
+
+    def sync(self, rest, table):
+        """Returns the up-to-date rows of `table` fetched through `rest`."""
+        if table in self._without_id:
+            return self._fetch(rest, table)
+        synced_at = time.time()
+        snapshot = self.load(table)
+        if snapshot is None:
+            return self._resync(rest, table, synced_at, 'no_snapshot',
+                                'нет снимка')
+
+        rows = snapshot['rows']
+        template = self.changed_since.get(table)
+        if template is None:
+            changed = self._fetch(
+                rest, table, f'id gt {snapshot["last_id"]}'
+            )
+            rows += changed
+        else:
+            since = datetime.fromtimestamp(
+                snapshot['synced_at'] - self.overlap, timezone.utc
+            ).strftime(_DATETIME_SIMPLE_FORMAT)
+            changed = self._fetch(
+                rest, table, template.format(since=since)
+            )
+            rows = self._merge(rows, changed)
+        self._sort(rows, rest._collection_order(table))
+        rest.metrics.inc('delta_rows_total', len(changed), table=table)
+
+        page, _ = rest._fetch_collection_page(table, 0, 1)
+        count = page['meta']['count']
+        if len(rows) != count:
+            return self._resync(
+                rest, table, synced_at, 'count_mismatch',
+                f'в снимке {len(rows)} строк, на сервере {count}'
+            )
+        self._logger.info('Таблица {}: получено изменений {}, всего {}'.format(
+            table, len(changed), count
+        ))
+        return self._store(table, rows, synced_at)
+
+    @classmethod
+    def from_config(cls, config, namespace=''):
+        return cls(
+            config['path'],
+            tables=config.get('tables'),
+            changed_since=config.get('changed_since'),
+            overlap=config.get('overlap', 60),
+            namespace=namespace,
+        )
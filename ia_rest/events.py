@@ -0,0 +1,216 @@
+import json
+from queue import Empty, Queue
+from threading import Event, Lock, Thread
+
+from websocket import WebSocketException, WebSocketTimeoutException
+
+from base.base import Base
+
+__all__ = [
+    'EventStream',
+    'RECONNECTED',
+    'Subscription',
+]
+
+RECONNECTED = 'EVENT_STREAM_RECONNECTED'
+
+
+class Subscription(object):
+    """
+    Queue of the websocket messages of the given types (any type if `msgs`
+    is empty) whose `data` matches `match`. A message that does not carry a
+    matched field is delivered too: not every server version sends it.
+    RECONNECTED is delivered to every subscription, since the messages it
+    waits for may have been missed.
+    """
+
+    def __init__(self, stream, msgs=None, match=None):
+        if isinstance(msgs, str):
+            msgs = (msgs,)
+        self.msgs = frozenset(msgs) if msgs else None
+        self.match = {key: str(value) for key, value in (match or {}).items()}
+        self._stream = stream
+        self._queue = Queue()
+        self._arrived = Event()
+
+    def matches(self, message):
+        if message.get('msg') == RECONNECTED:
+            return True
+        if self.msgs is not None and message.get('msg') not in self.msgs:
+            return False
+        data = message.get('data')
+        if not isinstance(data, dict):
+            return True
+        return all(
+            str(data[key]) == value
+            for key, value in self.match.items()
+            if key in data
+        )
+
+    def put(self, message):
+        self._queue.put(message)
+        self._arrived.set()
+
+    def wait(self, timeout=None):
+        """
+        Whether a message arrived since the previous `wait`, waiting up to
+        `timeout` seconds for one; the messages stay in the queue.
+        """
+        if not self._arrived.wait(timeout):
+            return False
+        self._arrived.clear()
+        return True
+
+    def drain(self):
+        """Takes every queued message without waiting."""
+        messages = []
+        while True:
+            try:
+                messages.append(self._queue.get_nowait())
+            except Empty:
+                return messages
+
+    def get(self, timeout=None):
+        """Next matching message; TimeoutError if none came in `timeout`."""
+        try:
+            return self._queue.get(timeout=timeout)
+        except Empty:
+            raise TimeoutError(
+                f'Нет сообщений {sorted(self.msgs or ())} за {timeout} с'
+            ) from None
+
+    def close(self):
+        self._stream.unsubscribe(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class EventStream(Base):
+    """
+    One long-lived websocket shared by any number of subscriptions.
+
+    A background thread reads and decodes messages and hands them to the
+    matching subscriptions. A dropped connection is reopened with
+    exponential backoff up to `max_backoff` seconds, after which a
+    RECONNECTED message is dispatched, since events may have been missed
+    meanwhile. The thread starts with the first subscription; `subscribe`
+    waits up to `connect_timeout` seconds for the connection, so an action
+    taken after subscribing cannot outrun its event.
+    """
+
+    def __init__(self, connect, loads=json.loads, recv_timeout=30,
+                 connect_timeout=30, max_backoff=30, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._connect = connect
+        self._loads = loads
+        self.recv_timeout = recv_timeout
+        self.connect_timeout = connect_timeout
+        self.max_backoff = max_backoff
+
+        self._subscriptions = []
+        self._lock = Lock()
+        self._thread = None
+        self._ws = None
+        self._connected = Event()
+        self._closing = Event()
+
+    def subscribe(self, msgs=None, **match):
+        subscription = Subscription(self, msgs, match)
+        with self._lock:
+            self._subscriptions.append(subscription)
+            if self._thread is None:
+                self._closing.clear()
+                self._thread = Thread(target=self._run, daemon=True,
+                                      name='ia-events')
+                self._thread.start()
+        if not self._connected.wait(self.connect_timeout):
+            self._logger.warning(
+                'Нет соединения с websocket, события могут быть пропущены'
+            )
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            if subscription in self._subscriptions:
+                self._subscriptions.remove(subscription)
+
+    def dispatch(self, message):
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+        for subscription in subscriptions:
+            if subscription.matches(message):
+                subscription.put(message)
+
+    def _read(self, ws):
+        while not self._closing.is_set():
+            try:
+                raw = ws.recv()
+            except WebSocketTimeoutException:
+                continue
+            try:
+                message = self._loads(raw)
+            except ValueError:
+                self._logger.debug(f'Не удалось разобрать сообщение {raw!r}')
+                continue
+            if isinstance(message, dict):
+                self.dispatch(message)
+
+    def _run(self):
+        backoff = 1
+        connected_before = False
+        while not self._closing.is_set():
+            try:
+                ws = self._connect(timeout=self.recv_timeout)
+            except (WebSocketException, OSError) as error:
+                self._logger.warning(
+                    f'Нет соединения с websocket: {error!r}, '
+                    f'повтор через {backoff} с'
+                )
+                self._closing.wait(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+                continue
+
+            backoff = 1
+            self._ws = ws
+            self._connected.set()
+            if connected_before:
+                self.dispatch({'msg': RECONNECTED, 'data': None})
+            connected_before = True
+            try:
+                self._read(ws)
+            except (WebSocketException, OSError) as error:
+                if not self._closing.is_set():
+                    self._logger.warning(
+                        f'Соединение с websocket потеряно: {error!r}'
+                    )
+            finally:
+                self._connected.clear()
+                self._ws = None
+                try:
+                    ws.close()
+                except (WebSocketException, OSError):
+                    pass
+
+    def close(self, timeout=5):
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is None:
+            return
+        self._closing.set()
+        ws = self._ws
+        if ws is not None:
+            try:
+                ws.abort()
+            except (WebSocketException, OSError, AttributeError):
+                pass
+        thread.join(timeout)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -1,51 +1,132 @@
-import json
-import ssl
 import time
 import uuid
-from datetime import datetime, timedelta
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 from functools import partialmethod
-from json import JSONDecodeError
-from mimetypes import guess_type
-from operator import ne, itemgetter
-from websocket import create_connection
+from logging import DEBUG
+from operator import ne
+from threading import RLock
 from time import sleep
 from urllib.parse import urljoin
 
-import pytz
 import urllib3
-from requests import Session
-from tqdm import tqdm
 
 __all__ = [
     'IARest',
+    'ImportResult',
 ]
 
 from base.base import Base
-from utils.list_to_dict import list_to_dict
+from ia_rest.cache import CollectionCache
+from ia_rest.credentials import CredentialStore
+from ia_rest.delta import DeltaSync
+from ia_rest.index import IndexRegistry
+from ia_rest.jsonlib import get_loads, preview
+from ia_rest.query import Query, QueryCache
+from ia_rest.table import CollectionTable
+from ia_rest.transport import make_session
+from ia_rest.upload import MultipartFile, gzip_chunks
+from ia_rest.wait import Waiter
+from utils.console import write
+from utils.metrics import REGISTRY, endpoint_of
 
 _DATETIME_SIMPLE_FORMAT = '%Y-%m-%dT%H:%M:%S'
 
+_COLLECTION_PAGE_SIZE = 100000
+
+_QUERY_CACHE_SIZE = 128
+
+_COLLECTION_ORDER_BY = {
+    'specification_item': ('parent_id', 'child_id'),
+    'operation_profession': ('operation_id', 'profession_id'),
+    'order_entry': ('order_id', 'entity_id'),
+}
+
+_REPORT_SIDE_TABLES = ('order', 'entity', 'department')
+
+_CREDENTIALS_PATH = '~/.cache/start_if_new_session/credentials.json'
+
+_ALLOCATION_EVENTS = ('STATE_ALLOCATION_COMPLETED', 'STATE_ALLOCATION_FAILED')
+
+_ALLOCATION_OUTCOMES = {
+    'STATE_ALLOCATION_COMPLETED': 'completed',
+    'STATE_ALLOCATION_FAILED': 'failed',
+}
+
+_SIMULATION_EVENTS = ('SIMULATION_SESSION_SUCCESSFULLY_FINISHED',
+                      'SIMULATION_SESSION_FAILED')
+
+_REPORT_NOT_READY = frozenset([
+    'STATIC_REPORT_HAS_NOT_BEEN_PROCEED_YET',
+    'STATIC_MODULE_DOES_NOT_HAVE_DATA',
+])
+
+ImportResult = namedtuple(
+    'ImportResult',
+    ['state_type', 'import_session_id', 'seconds', 'mismatches']
+)
+
+_IMPORT_KINDS = {
+    'wip': 'state',
+    'setup': 'equipment_adjustment',
+}
+
+_AUTH_ERRORS = frozenset([
+    'UNAUTHORIZED',
+    'NOT_AUTHORIZED',
+    'AUTHORIZATION_REQUIRED',
+    'AUTHENTICATION_REQUIRED',
+    'SESSION_EXPIRED',
+])
+
 
 class IARest(Base):
 
     def __init__(self, login, password, base_url, ws_url,
-                 *args, **kwargs):
+                 *args, page_size=_COLLECTION_PAGE_SIZE, workers=1,
+                 disk_cache=None, credentials=None, session=None,
+                 json_loads=None, metrics=None, as_table=False, delta=None,
+                 waiter=None, compress_uploads=False,
+                 query_cache_size=_QUERY_CACHE_SIZE, **kwargs):
         super().__init__(*args, **kwargs)
         self._base_url = base_url
         self._login = login
         self._password = password
         self.ws_url = ws_url
 
-        self._session = Session()
+        self.page_size = page_size
+        self.workers = workers
+        self.as_table = as_table
+        self.compress_uploads = compress_uploads
+
+        self._session = session or make_session(pool_size=max(10, workers))
         self._session.verify = False
 
+        self._json_loads = json_loads or get_loads()
+        self.metrics = metrics or REGISTRY
+        self.waiter = waiter or Waiter(metrics=self.metrics)
+
+        self.credentials = credentials
+        self._user = None
+        self._login_generation = 0
+        self._login_lock = RLock()
+
         self.cache = {}
+        self.indexes = IndexRegistry()
+        self.queries = QueryCache(query_cache_size)
+        self.disk_cache = disk_cache
+        self.delta = delta
+        self._events = None
+        self._primary_session = None
         urllib3.disable_warnings()
 
     def __enter__(self):
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
+        if self._events is not None:
+            self._events.close()
         self._session.close()
 
     def _make_url(self, uri):
@@ -59,77 +140,388 @@ class IARest(Base):
         )
 
     def _check_status(self, uri):
-        return self._session.get(
-            self._make_url(uri)
+        url = self._make_url(uri)
+        return self._with_auth(
+            lambda: self._session.get(url)
         ).status_code
 
-    def _wait_for_status(self, uri, status, operator=ne):
-        while operator(self._check_status(uri), status):
-            sleep(5)
+    def _wait_for_status(self, uri, status, operator=ne, timeout=None):
+        return self.waiter.poll(
+            lambda: self._check_status(uri), 'status',
+            done=lambda code: not operator(code, status),
+            timeout=timeout, max_interval=30
+        )
 
-    def get_from_rest_collection(self, table, filter=None):
-        if table in self.cache:
-            return self.cache[table]
-        result = []
-        self._perform_login()
-        counter = 0
-        step = 100000
-        if table == 'specification_item':
-            order_by = '&order_by=parent_id&order_by=child_id'
-        elif table == 'operation_profession':
-            order_by = '&order_by=operation_id&order_by=profession_id'
-        elif table == 'order_entry':
-            order_by = '&order_by=order_id&order_by=entity_id'
-        else:
-            order_by = '&order_by=id'
-        pbar = tqdm(desc=f'Получение данных из таблицы {table}')
-        while True:
-            request_str = f'rest/collection/{table}' \
-                      f'?start={counter}' \
-                      f'&stop={counter + step}' \
+    def _sleep(self, seconds, reason):
+        started = time.perf_counter()
+        sleep(seconds)
+        self.metrics.inc('wait_seconds_total',
+                         time.perf_counter() - started, reason=reason)
+
+    @staticmethod
+    def _collection_order(table):
+        """Fields a whole collection is ordered by."""
+        return _COLLECTION_ORDER_BY.get(table, ('id',))
+
+    @staticmethod
+    def _collection_uri(table, start, stop, filter=None, order_by=None,
+                        expand=()):
+        order_by = ''.join(
+            f'&order_by={field}'
+            for field in order_by or IARest._collection_order(table)
+        )
+        request_str = f'rest/collection/{table}' \
+                      f'?start={start}' \
+                      f'&stop={stop}' \
                       f'{order_by}'
-            if filter is not None:
-                request_str += f'&filter={{{filter}}}'
-            temp = self._perform_get(request_str)
-            pbar.total = temp['meta']['count']
-            counter += step
-            pbar.update(min(
-                step,
-                temp['meta']['count'] - (counter - step)
-            ))
-            if table not in temp:
-                break
-            result += temp[table]
-            if counter >= temp['meta']['count']:
-                break
+        request_str += ''.join(f'&with={side}' for side in expand)
+        if filter is not None:
+            request_str += f'&filter={{{filter}}}'
+        return request_str
+
+    @staticmethod
+    def _iter_concurrent(func, args, workers):
+        """
+        Yields func(arg) for every arg in the original order, keeping at
+        most `workers` calls in flight.
+        """
+        if workers <= 1:
+            for arg in args:
+                yield func(arg)
+            return
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = deque()
+            try:
+                for arg in args:
+                    pending.append(executor.submit(func, arg))
+                    if len(pending) >= workers:
+                        yield pending.popleft().result()
+                while pending:
+                    yield pending.popleft().result()
+            finally:
+                for future in pending:
+                    future.cancel()
+
+    def _fetch_collection_page(self, table, start, stop, filter=None,
+                               order_by=None, expand=()):
+        started = time.perf_counter()
+        page = self._perform_get(
+            self._collection_uri(table, start, stop, filter, order_by, expand)
+        )
+        return page, time.perf_counter() - started
+
+    def _iter_collection_pages(self, table, filter=None, page_size=None,
+                               workers=None, on_page=None, order_by=None,
+                               expand=(), whole_pages=False):
+        """
+        Yields the rows of every page, or the pages themselves (with the
+        `expand` side tables) if `whole_pages` is set.
+        """
+        page_size = page_size or self.page_size
+        workers = workers or self.workers
+
+        def report(start, page, elapsed):
+            count = page['meta']['count']
+            pbar.total = count
+            pbar.update(max(0, min(page_size, count - start)))
+            self.metrics.inc('pages_total', table=table)
+            self.metrics.inc('rows_total', len(page.get(table, ())),
+                             table=table)
+            if on_page is not None:
+                on_page(
+                    table=table,
+                    start=start,
+                    rows=len(page.get(table, ())),
+                    total=count,
+                    seconds=elapsed
+                )
+
+        from tqdm import tqdm
+
+        with tqdm(desc=f'Получение данных из таблицы {table}') as pbar:
+            first, elapsed = self._fetch_collection_page(
+                table, 0, page_size, filter, order_by, expand
+            )
+            report(0, first, elapsed)
+            if table not in first:
+                return
+            yield first if whole_pages else first[table]
+
+            starts = range(page_size, first['meta']['count'], page_size)
+            pages = self._iter_concurrent(
+                lambda start: self._fetch_collection_page(
+                    table, start, start + page_size, filter, order_by, expand
+                ),
+                starts,
+                workers
+            )
+            for start, (page, elapsed) in zip(starts, pages):
+                report(start, page, elapsed)
+                if table not in page:
+                    return
+                yield page if whole_pages else page[table]
+
+    def iter_rest_collection(self, table, filter=None, page_size=None,
+                             workers=None, on_page=None, batches=False):
+        """
+        Yields collection rows page by page without keeping the whole table
+        in memory (or whole pages if `batches` is set). At most `workers`
+        pages are held at a time.
+        """
+        cached = self._get_cached_collection(table, filter)
+        if cached is not None:
+            if batches:
+                yield cached
+            else:
+                yield from cached
+            return
+        for rows in self._iter_collection_pages(table, filter, page_size,
+                                                workers, on_page):
+            if batches:
+                yield rows
+            else:
+                yield from rows
+
+    @staticmethod
+    def _as_requested(rows, as_table):
+        if as_table and not isinstance(rows, CollectionTable):
+            return CollectionTable(rows)
+        if not as_table and isinstance(rows, CollectionTable):
+            return rows.to_dicts()
+        return rows
+
+    def get_from_rest_collection(self, table, filter=None, page_size=None,
+                                 workers=None, on_page=None, as_table=None):
+        """
+        Returns the whole collection as a list of dicts or, with `as_table`
+        (defaults to the `as_table` option of the client), as a columnar
+        CollectionTable. Filtered requests go through `query` and its cache.
+        """
+        if as_table is None:
+            as_table = self.as_table
+        if filter is not None:
+            return self.run_query(
+                self.query(table).filter(filter), as_table=as_table,
+                page_size=page_size, workers=workers, on_page=on_page
+            )
+        cached = self._get_cached_collection(table, filter)
+        if cached is not None:
+            return self._as_requested(cached, as_table)
+        if filter is None and self.delta is not None and \
+                self.delta.handles(table):
+            result = self.cache[table] = self.delta.sync(self, table)
+            return self._as_requested(result, as_table)
+        result = CollectionTable(name=table) if as_table else []
+        for rows in self._iter_collection_pages(table, filter, page_size,
+                                                workers, on_page):
+            result += rows
         if filter is None:
             self.cache[table] = result
+        if self.disk_cache is not None:
+            self.disk_cache.put(table, result, filter,
+                                self._cache_session())
+        return result
+
+    def query(self, table):
+        """A Query on the collection `table` bound to this client."""
+        return Query(table, rest=self)
+
+    def run_query(self, query, as_table=None, fresh=False, page_size=None,
+                  workers=None, on_page=None):
+        """
+        Results of a Query. Identical queries (see Query.key) are served
+        from an LRU of `query_cache_size` entries and from the disk cache;
+        `fresh` skips both and refreshes them.
+        """
+        if as_table is None:
+            as_table = self.as_table
+        if query.is_plain:
+            return self.get_from_rest_collection(
+                query.table, page_size=page_size, workers=workers,
+                on_page=on_page, as_table=as_table
+            )
+        result = None if fresh else self.queries.get(query.key)
+        if result is None and not fresh and self.disk_cache is not None:
+            result = self.disk_cache.get(query.table, query.cache_filter,
+                                         self._cache_session())
+        self.metrics.inc('query_cache_total', table=query.table,
+                         result='miss' if result is None else 'hit')
+        if result is None:
+            result = self._fetch_query(query, page_size, workers, on_page)
+            if self.disk_cache is not None:
+                self.disk_cache.put(query.table, result, query.cache_filter,
+                                    self._cache_session())
+        self.queries.put(query.key, result)
+        if query.expanded:
+            return result
+        return self._as_requested(result, as_table)
+
+    def _fetch_query(self, query, page_size, workers, on_page):
+        pages = self._iter_collection_pages(
+            query.table, query.filter_string, page_size, workers, on_page,
+            order_by=query.order, expand=query.expanded, whole_pages=True
+        )
+        if not query.expanded:
+            result = []
+            for page in pages:
+                result += query.project(page[query.table])
+            return result
+        return self._merge_report_pages(
+            (dict(page, **{query.table: query.project(page[query.table])})
+             for page in pages),
+            query.expanded
+        )
+
+    def get_entity(self, table, entity_id):
+        """
+        A single row from the `rest/{table}/{id}` route, or None if there
+        is no such row; never cached.
+        """
+        answer = self._perform_get(f'rest/{table}/{entity_id}')
+        if not isinstance(answer, dict):
+            return None
+        return answer.get(table)
+
+    def index(self, table, *fields, unique=False):
+        """
+        Lazily built index of the whole (cached) collection `table` by
+        `fields`, reused until the cache entry is replaced:
+
+            ia.index('specification_item', 'parent_id', 'child_id')\
+                .group(parent_id, child_id)
+        """
+        rows = self._get_cached_collection(table)
+        if rows is None:
+            self.get_from_rest_collection(table)
+            rows = self.cache[table]
+        return self.indexes.get(table, rows, fields, unique)
+
+    def _cache_session(self):
+        if self._primary_session is None:
+            self._get_main_session()
+        return self._primary_session
+
+    def _get_cached_collection(self, table, filter=None):
+        if filter is None and table in self.cache:
+            return self.cache[table]
+        if self.disk_cache is None:
+            return None
+        result = self.disk_cache.get(table, filter, self._cache_session())
+        if result is not None and filter is None:
+            self.cache[table] = result
         return result
 
+    def connect_messages(self, timeout=None):
+        import ssl
+        from websocket import create_connection
+
+        return create_connection(
+            f'{self.ws_url}/message',
+            timeout=timeout,
+            sslopt={'cert_reqs': ssl.CERT_NONE}
+        )
+
+    @property
+    def events(self):
+        """The websocket EventStream shared by all waits of this client."""
+        if self._events is None:
+            from ia_rest.events import EventStream
+
+            with self._login_lock:
+                if self._events is None:
+                    self._events = EventStream(
+                        self.connect_messages, loads=self._json_loads
+                    )
+        return self._events
+
     def _get_main_session(self):
-        return self._perform_get('action/primary_simulation_session')['data']
+        self._primary_session = self._perform_get(
+            'action/primary_simulation_session'
+        )['data']
+        return self._primary_session
+
+    @staticmethod
+    def _is_auth_error(response):
+        if response.status_code == 401:
+            return True
+        if response.status_code < 400:
+            return False
+        try:
+            errors = response.json().get('errors') or []
+        except (ValueError, AttributeError):
+            return False
+        return any(
+            isinstance(error, dict) and error.get('name') in _AUTH_ERRORS
+            for error in errors
+        )
+
+    def _with_auth(self, send):
+        """
+        Calls `send` (which performs one HTTP request) with a valid login,
+        logging in again once if the server rejects the session.
+        """
+        self._ensure_login()
+        generation = self._login_generation
+        response = send()
+        if self._is_auth_error(response):
+            self._logger.info('Сессия на сервере истекла, '
+                              'выполняется повторный вход.')
+            self._relogin(generation)
+            response = send()
+        return response
+
+    def _timed_send(self, http_method, uri, send):
+        endpoint = endpoint_of(uri)
+        started = time.perf_counter()
+        try:
+            response = send()
+        except Exception:
+            self.metrics.inc('requests_total', method=http_method,
+                             endpoint=endpoint, status='error')
+            raise
+        seconds = time.perf_counter() - started
+        size = len(response.content)
+        self.metrics.inc('requests_total', method=http_method,
+                         endpoint=endpoint, status=response.status_code)
+        self.metrics.observe('request_seconds', seconds,
+                             method=http_method, endpoint=endpoint)
+        self.metrics.inc('response_bytes_total', size,
+                         method=http_method, endpoint=endpoint)
+        self.metrics.event('request', method=http_method, endpoint=endpoint,
+                           status=response.status_code, seconds=seconds,
+                           bytes=size)
+        return response
 
-    def _perform_json_request(self, http_method, uri, **kwargs):
+    def _perform_json_request(self, http_method, uri, *, authenticate=True,
+                              **kwargs):
         url = self._make_url(uri)
         logger = self._logger
+        debug = logger.isEnabledFor(DEBUG)
 
-        logger.debug('Выполнение {} запроса '
-                    'по ссылке {!r}.'.format(http_method, url))
+        if debug:
+            logger.debug('Выполнение {} запроса '
+                         'по ссылке {!r}.'.format(http_method, url))
+            logger.debug('Отправляемые данные: {}.'.format(preview(kwargs)))
 
-        logger.debug('Отправляемые данные: {!r}.'.format(kwargs))
+        def send():
+            return self._timed_send(
+                http_method, uri,
+                lambda: self._session.request(http_method, url=url, **kwargs)
+            )
 
-        response = self._session.request(http_method,
-                                         url=url,
-                                         **kwargs)
+        response = self._with_auth(send) if authenticate else send()
         try:
-            response_json = response.json()
-        except JSONDecodeError:
+            response_json = self._json_loads(response.content)
+        except ValueError:
             logger.error('Получен ответ на {} запрос по ссылке {!r}: '
-                         '{!r}'.format(http_method, url, response))
-            raise JSONDecodeError
+                         '{!r} {}'.format(http_method, url, response,
+                                          preview(response.content)))
+            raise
 
-        logger.debug('Получен ответ на {} запрос по ссылке {!r}: '
-                     '{!r}'.format(http_method, url, response_json))
+        if debug:
+            logger.debug('Получен ответ на {} запрос по ссылке {!r}: '
+                         '{}'.format(http_method, url,
+                                     preview(response.content)))
         return response_json
 
     _perform_get = partialmethod(_perform_json_request, 'GET')
@@ -148,14 +540,49 @@ class IARest(Base):
         )
 
     def _perform_login(self):
-        return self._perform_action(
-            'login',
-            data={
-                'login': self._login,
-                'password': self._password
-            },
-            action='login'
-        )['data']
+        with self._login_lock:
+            self._user = self._perform_json_request(
+                'POST',
+                '/action/login',
+                authenticate=False,
+                json={
+                    'data': {
+                        'login': self._login,
+                        'password': self._password
+                    },
+                    'action': 'login'
+                }
+            )['data']
+            self._login_generation += 1
+            if self.credentials is not None:
+                self.credentials.save(self._login, self._base_url,
+                                      self._session.cookies, self._user)
+            return self._user
+
+    def _ensure_login(self):
+        if self._user is not None:
+            return
+        with self._login_lock:
+            if self._user is not None:
+                return
+            if self.credentials is not None:
+                user = self.credentials.load(self._login, self._base_url,
+                                             self._session.cookies)
+                if user is not None:
+                    self._user = user
+                    return
+            self._perform_login()
+
+    def _relogin(self, generation):
+        with self._login_lock:
+            if self._login_generation == generation:
+                self._session.cookies.clear()
+                self._perform_login()
+
+    @property
+    def current_user(self):
+        self._ensure_login()
+        return self._user
 
     def _perform_import_action(self, import_type, **kwargs):
         return self._perform_action(
@@ -163,7 +590,14 @@ class IARest(Base):
             **kwargs
         ).get('data')
 
-    def _perform_upload(self, filepath):
+    def _perform_upload(self, filepath, compress=None):
+        """
+        Streams the file from disk as multipart/form-data; with `compress`
+        (defaults to the `compress_uploads` option) the request body is
+        gzip-encoded, for servers that accept Content-Encoding: gzip.
+        """
+        if compress is None:
+            compress = self.compress_uploads
         url = self._make_url('/action/upload')
 
         self._logger.info(
@@ -172,17 +606,20 @@ class IARest(Base):
             )
         )
 
-        with open(filepath, 'rb') as f:
-            return self._session.post(
-                url=url,
-                files={
-                    'data': (
-                        filepath,
-                        f,
-                        guess_type(filepath)
-                    )
-                }
-            ).json()['data']
+        def upload():
+            with MultipartFile(filepath) as body:
+                headers = {'Content-Type': body.content_type}
+                data = body
+                if compress:
+                    headers['Content-Encoding'] = 'gzip'
+                    data = gzip_chunks(body)
+                return self._session.post(url=url, data=data,
+                                          headers=headers)
+
+        def send():
+            return self._timed_send('POST', '/action/upload', upload)
+
+        return self._json_loads(self._with_auth(send).content)['data']
 
     def perform_plan_import(self, filepath):
         logger = self._logger
@@ -202,8 +639,25 @@ class IARest(Base):
             }
         )
 
-    def _perform_state_import(self, state_type, import_config):
+    def iter_import_mismatch(self, import_session_id, batches=False):
+        """Streams the import_mismatch rows of one import page by page."""
+        for rows in self._iter_collection_pages(
+                'import_mismatch',
+                f'import_session_id eq {import_session_id}'
+        ):
+            if batches:
+                yield rows
+            else:
+                yield from rows
+
+    def _perform_state_import(self, state_type, import_config, timeout=None):
+        """
+        Uploads and imports one file and waits for the import to finish.
+        Returns an ImportResult whose `mismatches` lazily streams the
+        import_mismatch report.
+        """
         logger = self._logger
+        started = time.perf_counter()
 
         logger.info('Импорт даннных в таблицу {} запущен.'.format(state_type))
 
@@ -212,18 +666,16 @@ class IARest(Base):
             filepath=self._perform_upload(import_config)
         )['import_session_id']
 
-        self._wait_for_status('/action/import/{}'.format(state_type), 400)
-
-        self._perform_get(
-            '/rest/collection/import_mismatch',
-            params={
-                'filter': 'import_session_id eq {}'.format(
-                    state_import_session_id
-                )
-            }
-        )
+        self._wait_for_status('/action/import/{}'.format(state_type), 400,
+                              timeout=timeout)
 
         logger.info('Импорт данных в таблицу {} завершен.'.format(state_type))
+        return ImportResult(
+            state_type,
+            state_import_session_id,
+            time.perf_counter() - started,
+            self.iter_import_mismatch(state_import_session_id)
+        )
 
     perform_wip_import = partialmethod(
         _perform_state_import,
@@ -235,111 +687,205 @@ class IARest(Base):
         'equipment_adjustment'
     )
 
-    def start_simulation(self, plan_id, equipment_variation_id,
-                         employee_variation_id, entity_batch_variation_id,
-                         simulation_settings_id, equipment_amount_variation_id,
-                         sim_period=None,
-                         start_time=3):
-        ws = create_connection(
-            f'{self.ws_url}/message',
-            sslopt={'cert_reqs': ssl.CERT_NONE}
-        )
-        user_id = self._perform_login()['id']
-        allocation_check = self._perform_action(
-            'state_allocation/check',
-            data={
-                'plan_id': plan_id,
-                'allocation_types': [{'type': 1}, {'type': 0}]
-            }
-        )['data']
+    def perform_imports(self, imports, concurrency=2):
+        """
+        Runs independent imports given as (kind, filepath) pairs, kind being
+        'plan', 'state' (or 'wip') or 'equipment_adjustment' (or 'setup').
+        Imports of different kinds run concurrently, at most `concurrency`
+        kinds at a time; imports of one kind run one after another, as the
+        server reports a single import status per kind. Returns the results
+        in the given order.
+        """
+        imports = [
+            (_IMPORT_KINDS.get(kind, kind), filepath)
+            for kind, filepath in imports
+        ]
+        by_kind = {}
+        for position, (kind, _) in enumerate(imports):
+            by_kind.setdefault(kind, []).append(position)
+        results = [None] * len(imports)
+
+        def run(positions):
+            for position in positions:
+                kind, filepath = imports[position]
+                if kind == 'plan':
+                    results[position] = self.perform_plan_import(filepath)
+                else:
+                    results[position] = self._perform_state_import(
+                        kind, filepath
+                    )
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for future in [executor.submit(run, positions)
+                           for positions in by_kind.values()]:
+                future.result()
+        return results
+
+    @staticmethod
+    def _allocation_types(allocation_check):
         types = []
         for row in allocation_check:
             if row['data']['allocated']:
                 types.append(row['type'])
-        wip_allocation_uuid = str(uuid.uuid4())
-        allocation_data = self._perform_action(
-            'state_allocation/allocate',
+        return types
+
+    def _check_allocation(self, plan_id):
+        return self._perform_action(
+            'state_allocation/check',
             data={
-                'state_allocation_session_uuid': wip_allocation_uuid,
                 'plan_id': plan_id,
-                'allocation_types': [
-                    {'type': each_type} for each_type in types
-                ],
+                'allocation_types': [{'type': 1}, {'type': 0}]
             }
-        )
-        # while True:
-        #     message = json.loads(ws.recv())
-        #     self._logger.info(str(message))
-        #     if message['msg'] == 'STATE_ALLOCATION_COMPLETED':
-        #         break
-        #     if message['msg'] == 'STATE_ALLOCATION_FAILED':
-        #         raise
-        time.sleep(10)
+        )['data']
+
+    @staticmethod
+    def _allocation_outcome(message, allocation_uuid):
+        """
+        'completed' or 'failed' for an event about the allocation
+        `allocation_uuid`; None for anything else, including events that do
+        not name their allocation, since they may be about another one.
+        """
+        data = message.get('data')
+        if not isinstance(data, dict) or str(
+                data.get('state_allocation_session_uuid')
+        ) != allocation_uuid:
+            return None
+        return _ALLOCATION_OUTCOMES.get(message.get('msg'))
+
+    def _wait_allocation(self, subscription, plan_id, allocation_uuid,
+                         before, timeout):
+        """
+        Waits for the completion event of the allocation. Every other
+        message (a reconnect, an event without the allocation uuid) and a
+        poll every few seconds make the server be asked instead: the
+        allocation counts as finished once the state_allocation/check
+        answer differs from `before`, taken before it was started. A
+        timeout with neither is an error.
+        """
+        def check():
+            for message in subscription.drain():
+                outcome = self._allocation_outcome(message, allocation_uuid)
+                if outcome == 'failed':
+                    raise RuntimeError(
+                        f'Распределение состояния не выполнено: {message}'
+                    )
+                if outcome == 'completed':
+                    return message
+            if self._check_allocation(plan_id) != before:
+                return {'msg': 'STATE_ALLOCATION_CHECK_CHANGED'}
+            return None
+
+        try:
+            return self.waiter.poll(
+                check, 'state_allocation', timeout=timeout,
+                subscription=subscription, initial=1, max_interval=10
+            )
+        except TimeoutError:
+            raise RuntimeError(
+                f'Распределение состояния не завершилось за {timeout} с'
+            ) from None
 
+    @staticmethod
+    def _simulation_session_data(plan_id, equipment_variation_id,
+                                 employee_variation_id,
+                                 entity_batch_variation_id,
+                                 simulation_settings_id,
+                                 equipment_amount_variation_id,
+                                 user_id, sim_period=None, start_time=3):
         if sim_period is None:
-            simulation_session_id = self._perform_post(
-                'rest/simulation_session',
-                data={
-                    'simulation_session': {
-                        'employee_variation_id': employee_variation_id,
-                        'entity_batch_variation_id': entity_batch_variation_id,
-                        'entity_route_variation_id': None,
-                        'equipment_amount_variation_id': equipment_amount_variation_id,
-                        'equipment_variation_id': equipment_variation_id,
-                        'include_state': True,
-                        'operation_task_variation_id': None,
-                        'operation_variation_id': None,
-                        'plan_id': plan_id,
-                        'post_types': [24, 20, 25, 22],
-                        'simulation_settings_id': simulation_settings_id,
-                        'start_date': datetime.now(pytz.UTC).replace(
-                            hour=start_time,
-                            minute=0,
-                            second=0
-                        ).strftime(
-                            _DATETIME_SIMPLE_FORMAT
-                        ),
-                        'type': 0,
-                        'user_id': user_id
-                    }
+            return {
+                'simulation_session': {
+                    'employee_variation_id': employee_variation_id,
+                    'entity_batch_variation_id': entity_batch_variation_id,
+                    'entity_route_variation_id': None,
+                    'equipment_amount_variation_id': equipment_amount_variation_id,
+                    'equipment_variation_id': equipment_variation_id,
+                    'include_state': True,
+                    'operation_task_variation_id': None,
+                    'operation_variation_id': None,
+                    'plan_id': plan_id,
+                    'post_types': [24, 20, 25, 22],
+                    'simulation_settings_id': simulation_settings_id,
+                    'start_date': datetime.now(timezone.utc).replace(
+                        hour=start_time,
+                        minute=0,
+                        second=0
+                    ).strftime(
+                        _DATETIME_SIMPLE_FORMAT
+                    ),
+                    'type': 0,
+                    'user_id': user_id
                 }
-            )['simulation_session']['id']
-        else:
-            simulation_session_id = self._perform_post(
-                'rest/simulation_session',
+            }
+        return {
+            'simulation_session': {
+                'employee_variation_id': employee_variation_id,
+                'entity_batch_variation_id': entity_batch_variation_id,
+                'entity_route_variation_id': None,
+                'equipment_amount_variation_id': None,
+                'equipment_variation_id': equipment_variation_id,
+                'include_state': True,
+                'operation_task_variation_id': None,
+                'operation_variation_id': None,
+                'plan_id': plan_id,
+                'post_types': [],
+                'simulation_settings_id': simulation_settings_id,
+                'start_date': datetime.now(timezone.utc).replace(
+                    hour=start_time,
+                    minute=0,
+                    second=0
+                ).strftime(
+                    _DATETIME_SIMPLE_FORMAT
+                ),
+                'stop_date': (
+                        datetime.now(
+                            timezone.utc
+                        ) + timedelta(
+                            days=sim_period
+                        )).strftime(
+                    _DATETIME_SIMPLE_FORMAT
+                ),
+                'type': 2,
+                'user_id': user_id
+            }
+        }
+
+    def start_simulation(self, plan_id, equipment_variation_id,
+                         employee_variation_id, entity_batch_variation_id,
+                         simulation_settings_id, equipment_amount_variation_id,
+                         sim_period=None,
+                         start_time=3, allocation_timeout=600):
+        user_id = self.current_user['id']
+        before = self._check_allocation(plan_id)
+        types = self._allocation_types(before)
+        wip_allocation_uuid = str(uuid.uuid4())
+        with self.events.subscribe(
+                _ALLOCATION_EVENTS,
+                state_allocation_session_uuid=wip_allocation_uuid
+        ) as allocation:
+            self._perform_action(
+                'state_allocation/allocate',
                 data={
-                    'simulation_session': {
-                        'employee_variation_id': employee_variation_id,
-                        'entity_batch_variation_id': entity_batch_variation_id,
-                        'entity_route_variation_id': None,
-                        'equipment_amount_variation_id': None,
-                        'equipment_variation_id': equipment_variation_id,
-                        'include_state': True,
-                        'operation_task_variation_id': None,
-                        'operation_variation_id': None,
-                        'plan_id': plan_id,
-                        'post_types': [],
-                        'simulation_settings_id': simulation_settings_id,
-                        'start_date': datetime.now(pytz.UTC).replace(
-                            hour=start_time,
-                            minute=0,
-                            second=0
-                        ).strftime(
-                            _DATETIME_SIMPLE_FORMAT
-                        ),
-                        'stop_date': (
-                                datetime.now(
-                                    pytz.UTC
-                                ) + timedelta(
-                                    days=sim_period
-                                )).strftime(
-                            _DATETIME_SIMPLE_FORMAT
-                        ),
-                        'type': 2,
-                        'user_id': user_id
-                    }
+                    'state_allocation_session_uuid': wip_allocation_uuid,
+                    'plan_id': plan_id,
+                    'allocation_types': [
+                        {'type': each_type} for each_type in types
+                    ],
                 }
-            )['simulation_session']['id']
+            )
+            self._wait_allocation(allocation, plan_id, wip_allocation_uuid,
+                                  before, allocation_timeout)
+
+        simulation_session_id = self._perform_post(
+            'rest/simulation_session',
+            data=self._simulation_session_data(
+                plan_id, equipment_variation_id, employee_variation_id,
+                entity_batch_variation_id, simulation_settings_id,
+                equipment_amount_variation_id, user_id,
+                sim_period, start_time
+            )
+        )['simulation_session']['id']
+        self.queries.invalidate('simulation_session')
 
         self._logger.info(
             self._perform_post(
@@ -349,65 +895,93 @@ class IARest(Base):
         )
         return simulation_session_id
 
-    def clean_sessions(self, number: int) -> None:
-        sessions = self._perform_get('rest/simulation_session')['simulation_session']
-        sessions = sorted(sessions, key=itemgetter('id'), reverse=True)
-        for row in sessions[number:]:
-            self.delete_simulation(row['id'])
+    def clean_sessions(self, number=None, dry_run=False, concurrency=4,
+                       rate=10, **policy):
+        """
+        Deletes the simulation sessions not kept by
+        RetentionPolicy(keep_last=number, **policy): by default the newest
+        `number` ones, the primary and the running ones survive. Without
+        any keep rule only a dry run is allowed.
+        """
+        from ia_rest.retention import RetentionPolicy, SessionRetention
+
+        return SessionRetention(
+            self, RetentionPolicy(keep_last=number, **policy),
+            concurrency=concurrency, rate=rate
+        ).apply(dry_run=dry_run)
+
+    def delete_simulation(self, simulation_session_id: int) -> dict:
+        self.queries.invalidate('simulation_session')
+        return self._perform_delete(
+            f'rest/simulation_session/{simulation_session_id}'
+        )
+
+    def set_primary_simulation(self, simulation_session_id: int) -> None:
+        self._perform_action(
+            'primary_simulation_session',
+            data={
+                'simulation_session_id': simulation_session_id,
+                'cleanup': False
+            }
+        )
 
-    def delete_simulation(self, simulation_session_id: int) -> None:
-        self._perform_delete(f'rest/simulation_session/{simulation_session_id}')
+    def run_sweep(self, scenarios, concurrency=2, best=None, cleanup=False,
+                  poll_interval=300):
+        """
+        Runs start_simulation for every scenario (a dict of its arguments,
+        see sweep.scenario_grid) with at most `concurrency` simulations at a
+        time; see SimulationSweep.
+        """
+        from ia_rest.sweep import SimulationSweep
+
+        return SimulationSweep(
+            self, concurrency=concurrency, poll_interval=poll_interval
+        ).run(scenarios, best=best, cleanup=cleanup)
+
+    def _simulation_status(self, simulation_session_id):
+        simulation_session = self.get_entity(
+            'simulation_session', simulation_session_id
+        )
+        if simulation_session is None:
+            raise LookupError(
+                f'Расчет {simulation_session_id} не найден на сервере'
+            )
+        return simulation_session['status']
 
     def accept_simulation(
             self,
             simulation_session_id: int,
-            accept=True
+            accept=True,
+            poll_interval=300,
+            timeout=None
     ) -> None:
-        ws = create_connection(
-            f'{self.ws_url}/message',
-            sslopt={'cert_reqs': ssl.CERT_NONE}
-        )
+        """
+        Waits for the simulation to finish (checking its status on every
+        websocket event about it, and with a backoff of up to
+        `poll_interval` seconds in case an event is missed) and makes it
+        primary if it succeeded and `accept` is set.
+        """
         self._logger.info('Ожидаем завершения расчета')
-        while True:
-            message = json.loads(ws.recv())
-            self._logger.info(str(message))
-            try:
-                if message['data']['simulation_session_id'] != str(simulation_session_id):
-                    continue
-            except TypeError:
-                continue
-            if message['msg'] == 'SIMULATION_SESSION_SUCCESSFULLY_FINISHED':
-                self._logger.info('Расчет завершен')
-                break
-            if message['msg'] == 'SIMULATION_SESSION_FAILED':
-                self._logger.info('Расчет завершен с ошибкой')
-                break
-
-        # while self.get_from_rest_collection(
-        #         'simulation_session',
-        #         filter=f'id eq {simulation_session_id}'
-        # )[0]['status'] is None:
-        #     self._logger.info('Ожидаем завершения расчета')
-        #     sleep(60)
-        result = self.get_from_rest_collection(
-                'simulation_session',
-                filter=f'id eq {simulation_session_id}'
-        )[0]['status']
-        if result == 0 and accept:
-            self._perform_action(
-                'primary_simulation_session',
-                data={
-                    'simulation_session_id': simulation_session_id,
-                    'cleanup': False
-                }
+        with self.events.subscribe(
+                _SIMULATION_EVENTS,
+                simulation_session_id=simulation_session_id
+        ) as finished:
+            result = self.waiter.poll(
+                lambda: self._simulation_status(simulation_session_id),
+                'simulation', timeout=timeout, subscription=finished,
+                initial=min(30, poll_interval), max_interval=poll_interval
             )
+        self._logger.info('Расчет завершен')
+
+        if result == 0 and accept:
+            self.set_primary_simulation(simulation_session_id)
             self._logger.info('Расчет принят')
         else:
             self._logger.info(f'Расчет завершился со статусом {result}')
         return result
 
-    def get_trafficlight_data(self, session_id, department_id, direction):
-        self._perform_login()
+    def _resolve_trafficlight_filter(self, session_id, department_id,
+                                     direction):
         if session_id is None:
             sessions = self.get_from_rest_collection(
                 'static_session'
@@ -416,86 +990,143 @@ class IARest(Base):
             for row in sessions:
                 if row['type'] == 2:
                     session_id = max(session_id, row['id'])
-            tqdm.write(f"Сессия расчета {session_id}")
+            write(f"Сессия расчета {session_id}")
         self._perform_get(
             f"/data/static_result/{session_id}/consolidated/order_supply?offload=true"
         )
-        sleep(2)
-        departments = list_to_dict(self.get_from_rest_collection(
-            'department'
-        ))
-        dept_id = None
-        for each_id in departments:
-            if department_id is None:
-                break
-            if departments[each_id]['identity'] == department_id:
-                dept_id = each_id
-                break
-        while True:
-            try:
-                request = f"/data/static_result/{session_id}/consolidated/"\
-                          f"product_supply/preprocessed?"\
-                          f"with=order&with=entity&with=department&offload=true&"\
-                          f"start=0&stop=1&"
+        self._sleep(2, 'order_supply')
+        if department_id is None:
+            return session_id, None
+        department = self.index('department', 'identity').lookup(
+            department_id
+        )
+        if department is None:
+            return session_id, None
+        return session_id, f"{direction}_department_id eq {department['id']}"
 
-                if dept_id is not None:
-                    request += f"filter={{ {direction}_department_id eq {dept_id} }}"
+    @staticmethod
+    def _trafficlight_uri(session_id, start, stop, filter=None):
+        request = f"/data/static_result/{session_id}/consolidated/"\
+                  f"product_supply/preprocessed?"\
+                  f"with=order&with=entity&with=department&offload=true&"\
+                  f"start={start}&stop={stop}&"
+        if filter is not None:
+            request += f"filter={{ {filter} }}"
+        return request
 
-                result = self._perform_get(
-                    request
-                )
+    def _probe_trafficlight_report(self, session_id, filter=None):
+        """The first report row, or None while the report is not ready."""
+        try:
+            result = self._perform_get(
+                self._trafficlight_uri(session_id, 0, 1, filter)
+            )
+            if 'errors' in result:
+                self._logger.info(str(result))
+                if result['errors'][0]['name'] in _REPORT_NOT_READY:
+                    return None
+            if type(result['data']) == str or result['meta'] is None:
+                return None
+            return result
+        except TypeError:
+            return None
 
-                # print(result)
-                if 'errors' in result:
-                    self._logger.info(str(result))
-                    if result['errors'][0]['name'] == \
-                            'STATIC_REPORT_HAS_NOT_BEEN_PROCEED_YET':
-                        for _ in tqdm(range(120), desc="waiting..."):
-                            sleep(1)
-                        continue
-                    if result['errors'][0]['name'] == \
-                            'STATIC_MODULE_DOES_NOT_HAVE_DATA':
-                        for _ in tqdm(range(120), desc="waiting..."):
-                            sleep(1)
-                        continue
-                if type(result['data']) == str:
-                    for _ in tqdm(range(120), desc="waiting..."):
-                        sleep(1)
-                    continue
-                total_rows_number = result['meta']['count']
-                cur_row = 1
-                step = 100000
-                iter_rows = tqdm(desc='Запрашиваем отчет', total=total_rows_number)
-                while cur_row < total_rows_number:
-                    request = f"/data/static_result/{session_id}/consolidated/"\
-                              f"product_supply/preprocessed?"\
-                              f"with=order&with=entity&with=department&offload=true&"\
-                              f"start={cur_row}&stop={cur_row + step}&"
-                    if dept_id is not None:
-                        request += f"filter={{ {direction}_department_id eq {dept_id} }}"
-
-                    temp_result = self._perform_get(
-                        request
-                    )
+    def _wait_for_trafficlight_report(self, session_id, filter=None,
+                                      timeout=None):
+        return self.waiter.poll(
+            lambda: self._probe_trafficlight_report(session_id, filter),
+            'static_report', timeout=timeout, initial=5, max_interval=120,
+            on_retry=lambda result, delay: write(
+                f'Отчет еще не готов, повтор через {delay:.1f} с'
+            )
+        )
 
-                    for table in result:
-                        result[table] = [*result[table], *temp_result[table]]
+    def iter_trafficlight_data(self, session_id, department_id, direction,
+                               page_size=None, workers=None):
+        """
+        Yields raw report pages in order as they arrive; the first one is
+        the single-row readiness probe.
+        """
+        page_size = page_size or self.page_size
+        workers = workers or self.workers
+        session_id, filter = self._resolve_trafficlight_filter(
+            session_id, department_id, direction
+        )
+        first = self._wait_for_trafficlight_report(session_id, filter)
+        yield first
 
-                    iter_rows.update(step)
-                    cur_row += step
+        starts = range(1, first['meta']['count'], page_size)
+        pages = self._iter_concurrent(
+            lambda start: self._perform_get(self._trafficlight_uri(
+                session_id, start, start + page_size, filter
+            )),
+            starts,
+            workers
+        )
+        from tqdm import tqdm
+
+        with tqdm(desc='Запрашиваем отчет',
+                  total=first['meta']['count']) as iter_rows:
+            for page in pages:
+                iter_rows.update(page_size)
+                self.metrics.inc('pages_total', table='product_supply')
+                yield page
 
-                break
-            except TypeError:
-                for _ in tqdm(range(120), desc="waiting..."):
-                    sleep(1)
-                continue
+    @staticmethod
+    def _merge_report_pages(pages, side_tables=_REPORT_SIDE_TABLES):
+        """
+        Concatenates the main report table and deduplicates the side tables
+        (order, entity, department by default) by id; `meta` is taken from
+        the first page.
+        """
+        result = {}
+        merged_sides = {}
+        for page in pages:
+            for table, rows in page.items():
+                if table == 'meta':
+                    result.setdefault(table, rows)
+                elif table in side_tables:
+                    merged = merged_sides.setdefault(table, {})
+                    for row in rows:
+                        merged.setdefault(row['id'], row)
+                else:
+                    result.setdefault(table, []).extend(rows)
+        for table, rows in merged_sides.items():
+            result[table] = list(rows.values())
         return result
 
+    def get_trafficlight_data(self, session_id, department_id, direction,
+                              page_size=None, workers=None):
+        return self._merge_report_pages(self.iter_trafficlight_data(
+            session_id, department_id, direction, page_size, workers
+        ))
+
     @classmethod
     def from_config(cls, config):
+        workers = config.get('workers', 1)
+        transport = dict(config.get('transport') or {})
+        transport.setdefault('pool_size', max(10, workers))
         return cls(
             config['login'],
             config['password'],
             config['url'],
             config['ws_url'],
+            page_size=config.get('page_size', _COLLECTION_PAGE_SIZE),
+            workers=workers,
+            disk_cache=CollectionCache.from_config(
+                config['cache'], namespace=config['url']
+            ) if 'cache' in config else None,
+            credentials=CredentialStore.from_config(
+                config.get('credentials', _CREDENTIALS_PATH)
+            ) if config.get('credentials', _CREDENTIALS_PATH) else None,
+            session=make_session(**transport),
+            json_loads=get_loads(config.get('json')),
+            as_table=config.get('as_table', False),
+            delta=DeltaSync.from_config(
+                config['delta'], namespace=config['url']
+            ) if 'delta' in config else None,
+            waiter=Waiter.from_config(
+                config['wait'], metrics=REGISTRY
+            ) if 'wait' in config else None,
+            compress_uploads=config.get('compress_uploads', False),
+            query_cache_size=config.get('query_cache', _QUERY_CACHE_SIZE),
         )
@@ -0,0 +1,125 @@
+from threading import Lock
+
+from ia_rest.table import CollectionTable
+
+__all__ = [
+    'CollectionIndex',
+    'IndexRegistry',
+]
+
+
+class CollectionIndex(object):
+    """
+    Hash index over the rows of one collection by one field or a composite
+    key of several fields. Built on the first probe; holds row positions,
+    not row copies.
+
+    `lookup(*key)` returns the row (the first one for non-unique indexes) or
+    `default`, `group(*key)` returns all matching rows. A unique index
+    raises ValueError on a duplicate key while it is built.
+    """
+
+    def __init__(self, rows, fields, unique=False):
+        self.rows = rows
+        self.fields = tuple(fields)
+        self.unique = unique
+        self._positions = None
+        self._lock = Lock()
+
+    def _keys(self):
+        rows, fields = self.rows, self.fields
+        if isinstance(rows, CollectionTable):
+            columns = [rows[field] for field in fields]
+            return columns[0] if len(columns) == 1 else zip(*columns)
+        if len(fields) == 1:
+            field, = fields
+            return (row.get(field) for row in rows)
+        return (tuple(row.get(field) for field in fields) for row in rows)
+
+    def _build(self):
+        positions = {}
+        if self.unique:
+            for position, key in enumerate(self._keys()):
+                if positions.setdefault(key, position) != position:
+                    raise ValueError(
+                        f'Значение {key!r} поля {self.fields} не уникально'
+                    )
+        else:
+            for position, key in enumerate(self._keys()):
+                found = positions.get(key)
+                if found is None:
+                    positions[key] = position
+                elif type(found) is list:
+                    found.append(position)
+                else:
+                    positions[key] = [found, position]
+        return positions
+
+    @property
+    def positions(self):
+        if self._positions is None:
+            with self._lock:
+                if self._positions is None:
+                    self._positions = self._build()
+        return self._positions
+
+    def _key(self, key):
+        return key[0] if len(self.fields) == 1 else key
+
+    def lookup(self, *key, default=None):
+        found = self.positions.get(self._key(key))
+        if found is None:
+            return default
+        if type(found) is list:
+            found = found[0]
+        return self.rows[found]
+
+    def group(self, *key):
+        found = self.positions.get(self._key(key))
+        if found is None:
+            return []
+        if type(found) is list:
+            return [self.rows[position] for position in found]
+        return [self.rows[found]]
+
+    def __contains__(self, key):
+        if len(self.fields) == 1:
+            return key in self.positions
+        return tuple(key) in self.positions
+
+    def __len__(self):
+        return len(self.positions)
+
+    def keys(self):
+        return self.positions.keys()
+
+
+class IndexRegistry(object):
+    """
+    Indexes of cached collections keyed by table, fields and uniqueness.
+    The indexes of a table are dropped as soon as its cached rows are
+    replaced by another object, so an index never outlives its cache entry.
+    """
+
+    def __init__(self):
+        self._tables = {}
+        self._lock = Lock()
+
+    def get(self, table, rows, fields, unique=False):
+        with self._lock:
+            entry = self._tables.get(table)
+            if entry is None or entry[0] is not rows:
+                entry = self._tables[table] = (rows, {})
+            indexes = entry[1]
+            key = (tuple(fields), unique)
+            index = indexes.get(key)
+            if index is None:
+                index = indexes[key] = CollectionIndex(rows, fields, unique)
+            return index
+
+    def invalidate(self, table=None):
+        with self._lock:
+            if table is None:
+                self._tables.clear()
+            else:
+                self._tables.pop(table, None)
@@ -0,0 +1,50 @@
+import json
+import reprlib
+from importlib import import_module
+
+__all__ = [
+    'get_loads',
+    'preview',
+]
+
+_DECODERS = ('orjson', 'ujson', 'json')
+
+_PREVIEW_BYTES = 1024
+
+_repr = reprlib.Repr()
+_repr.maxlevel = 4
+_repr.maxdict = 10
+_repr.maxlist = 10
+_repr.maxstring = 200
+_repr.maxother = 200
+
+
+def get_loads(name=None):
+    """
+    Returns the `loads` function of the named decoder or, without a name,
+    of the fastest installed one (orjson, then ujson, then json). All of
+    them accept bytes and raise ValueError subclasses on bad input.
+    """
+    for decoder in (name,) if name else _DECODERS:
+        try:
+            return import_module(decoder).loads
+        except ImportError:
+            if name:
+                raise
+    return json.loads
+
+
+def preview(payload):
+    """
+    Short description of a request or response payload for debug logs:
+    bytes are shown as their size and head, anything else through a
+    size-limited repr.
+    """
+    if isinstance(payload, (bytes, bytearray)):
+        if len(payload) <= _PREVIEW_BYTES:
+            return payload.decode('utf-8', errors='replace')
+        return '{} байт: {}...'.format(
+            len(payload),
+            payload[:_PREVIEW_BYTES].decode('utf-8', errors='replace')
+        )
+    return _repr.repr(payload)
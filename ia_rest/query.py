@@ -0,0 +1,198 @@
+import re
+from collections import OrderedDict
+from threading import Lock
+
+__all__ = [
+    'Query',
+    'QueryCache',
+]
+
+_SPACES = re.compile(r'\s+')
+
+_QUOTED = re.compile(r"""('(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*")""")
+
+
+def _normalize(clause):
+    """Collapses whitespace outside quoted literals."""
+    parts = _QUOTED.split(clause)
+    parts[::2] = [_SPACES.sub(' ', part) for part in parts[::2]]
+    return ''.join(parts).strip()
+
+
+def _format_value(value):
+    if value is None:
+        return 'null'
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, (int, float)):
+        return str(value)
+    return "'{}'".format(str(value).replace("'", "\\'"))
+
+
+class Query(object):
+    """
+    Immutable description of a collection request; every method returns a
+    new query:
+
+        ia.query('simulation_session')\
+            .filter('status eq 0', plan_id=plan_id)\
+            .order_by('id')\
+            .only('id', 'status', 'start_date')\
+            .all()
+
+    Filters are joined with `and`, each one in parentheses; `order_by`
+    replaces the table's default ordering; `only` keeps the given fields of
+    every row (the collection route always returns whole rows, so they are
+    trimmed page by page before caching); `expand` adds `with=` side tables
+    where the endpoint supports them, the result is then a dict of the
+    table and its side tables as in get_trafficlight_data.
+
+    Queries that differ only in the order of their filters or in spacing
+    outside quoted literals share the same `key`; the filters themselves are
+    sent as given.
+    """
+
+    def __init__(self, table, where=(), order=None, fields=None, expanded=(),
+                 rest=None):
+        self.table = table
+        normalized = {}
+        for clause in where:
+            normalized.setdefault(_normalize(clause), clause.strip())
+        self._normalized = tuple(sorted(normalized))
+        self.where = tuple(normalized[key] for key in self._normalized)
+        self.order = None if order is None else tuple(order)
+        self.fields = None if fields is None else tuple(sorted(set(fields)))
+        self.expanded = tuple(sorted(set(expanded)))
+        self.rest = rest
+
+    def _replace(self, **changes):
+        params = dict(
+            table=self.table, where=self.where, order=self.order,
+            fields=self.fields, expanded=self.expanded, rest=self.rest
+        )
+        params.update(changes)
+        return Query(**params)
+
+    def filter(self, *clauses, **equals):
+        """
+        Adds raw filter clauses ('status eq 0') and `field eq value`
+        clauses for keyword arguments.
+        """
+        where = list(self.where)
+        where += [clause for clause in clauses if clause and clause.strip()]
+        where += [f'{field} eq {_format_value(value)}'
+                  for field, value in equals.items()]
+        return self._replace(where=where)
+
+    def order_by(self, *fields):
+        return self._replace(order=fields)
+
+    def only(self, *fields):
+        return self._replace(fields=fields)
+
+    def expand(self, *tables):
+        return self._replace(expanded=self.expanded + tables)
+
+    @property
+    def filter_string(self):
+        if len(self.where) > 1:
+            return ' and '.join(f'({clause})' for clause in self.where)
+        return self.where[0] if self.where else None
+
+    @property
+    def is_plain(self):
+        return not (self.where or self.order or self.fields or
+                    self.expanded)
+
+    @property
+    def key(self):
+        return (self.table, self._normalized, self.order, self.fields,
+                self.expanded)
+
+    @property
+    def cache_filter(self):
+        """
+        The normalized filters extended with everything else that changes
+        the result, for the on-disk CollectionCache.
+        """
+        parts = [' and '.join(self._normalized)]
+        if self.order is not None:
+            parts.append('order_by=' + ','.join(self.order))
+        if self.fields is not None:
+            parts.append('only=' + ','.join(self.fields))
+        if self.expanded:
+            parts.append('with=' + ','.join(self.expanded))
+        return '\0'.join(parts) or None
+
+    def project(self, rows):
+        if self.fields is None:
+            return rows
+        return [{field: row[field] for field in self.fields if field in row}
+                for row in rows]
+
+    def _bound_rest(self):
+        if self.rest is None:
+            raise RuntimeError(f'Запрос к {self.table} не связан с IARest')
+        return self.rest
+
+    def all(self, as_table=None, fresh=False):
+        return self._bound_rest().run_query(self, as_table=as_table,
+                                            fresh=fresh)
+
+    def first(self, fresh=False):
+        rows = self.all(as_table=False, fresh=fresh)
+        if self.expanded:
+            rows = rows.get(self.table, [])
+        return rows[0] if rows else None
+
+    def get(self, entity_id):
+        """The row with the given id from the single-entity route."""
+        row = self._bound_rest().get_entity(self.table, entity_id)
+        if row is None or self.fields is None:
+            return row
+        return self.project([row])[0]
+
+    def __eq__(self, other):
+        return isinstance(other, Query) and self.key == other.key
+
+    def __hash__(self):
+        return hash(self.key)
+
+    def __repr__(self):
+        return f'Query{self.key!r}'
+
+
+class QueryCache(object):
+    """Thread-safe LRU of query results keyed by Query.key."""
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def put(self, key, result):
+        if not self.maxsize:
+            return
+        with self._lock:
+            self._entries[key] = result
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, table=None):
+        with self._lock:
+            if table is None:
+                self._entries.clear()
+                return
+            for key in [key for key in self._entries if key[0] == table]:
+                del self._entries[key]
+
+    def __len__(self):
+        return len(self._entries)
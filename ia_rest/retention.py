@@ -0,0 +1,191 @@
+import time
+from collections import defaultdict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from threading import Lock
+
+from tqdm import tqdm
+
+from base.base import Base
+
+__all__ = [
+    'RetentionPolicy',
+    'RetentionReport',
+    'SessionRetention',
+]
+
+_DATETIME_SIMPLE_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+RetentionReport = namedtuple(
+    'RetentionReport',
+    ['kept', 'deleted', 'failed', 'seconds', 'dry_run']
+)
+
+
+def _parse_date(value):
+    if value is None or isinstance(value, datetime):
+        return value
+    return datetime.strptime(str(value)[:19], _DATETIME_SIMPLE_FORMAT)
+
+
+class RetentionPolicy(object):
+    """
+    Which simulation sessions survive a cleanup. A session is kept if any
+    rule keeps it:
+
+    - keep_last: the newest N sessions by id;
+    - keep_since: sessions whose `date_field` is not older than a datetime,
+      an ISO string or a number of days ago;
+    - keep_accepted: the newest N successfully finished (status 0) sessions
+      of every plan;
+    - keep_primary: the primary session;
+    - keep_running: sessions without a status yet.
+    """
+
+    def __init__(self, keep_last=None, keep_since=None, keep_accepted=None,
+                 keep_primary=True, keep_running=True,
+                 date_field='start_date'):
+        self.keep_last = keep_last
+        if isinstance(keep_since, (int, float)):
+            keep_since = datetime.utcnow() - timedelta(days=keep_since)
+        self.keep_since = _parse_date(keep_since)
+        self.keep_accepted = keep_accepted
+        self.keep_primary = keep_primary
+        self.keep_running = keep_running
+        self.date_field = date_field
+
+    @property
+    def has_keep_rules(self):
+        return any(rule is not None for rule in (
+            self.keep_last, self.keep_since, self.keep_accepted
+        ))
+
+    def ensure_keeps(self):
+        """ValueError for a policy that would keep no finished session."""
+        if not self.has_keep_rules:
+            raise ValueError(
+                'Не задано ни одного правила keep_last, keep_since или '
+                'keep_accepted: были бы удалены все завершенные расчеты'
+            )
+
+    def split(self, sessions, primary=None):
+        """Returns (kept, to delete) lists of sessions, newest first."""
+        sessions = sorted(sessions, key=lambda row: row['id'], reverse=True)
+        kept_ids = set()
+        if self.keep_last is not None:
+            kept_ids.update(row['id'] for row in sessions[:self.keep_last])
+        if self.keep_accepted is not None:
+            per_plan = defaultdict(int)
+            for row in sessions:
+                if row.get('status') == 0 and \
+                        per_plan[row.get('plan_id')] < self.keep_accepted:
+                    per_plan[row.get('plan_id')] += 1
+                    kept_ids.add(row['id'])
+        for row in sessions:
+            if self.keep_primary and primary is not None and \
+                    str(row['id']) == str(primary):
+                kept_ids.add(row['id'])
+            elif self.keep_running and row.get('status') is None:
+                kept_ids.add(row['id'])
+            elif self.keep_since is not None and row.get(self.date_field) \
+                    and _parse_date(row[self.date_field]) >= self.keep_since:
+                kept_ids.add(row['id'])
+        kept = [row for row in sessions if row['id'] in kept_ids]
+        deleted = [row for row in sessions if row['id'] not in kept_ids]
+        return kept, deleted
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(**config)
+
+
+class SessionRetention(Base):
+    """
+    Applies a RetentionPolicy to the simulation sessions of one server: the
+    session list is read page by page, the deletes run on `concurrency`
+    threads, no faster than `rate` per second in total, each retried up to
+    `retries` times with exponential backoff.
+
+    A policy without keep_last, keep_since or keep_accepted would delete
+    every finished session, so `apply` refuses it unless `dry_run` is set.
+    """
+
+    def __init__(self, rest, policy, concurrency=4, rate=10, retries=3,
+                 backoff=1, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.rest = rest
+        self.policy = policy
+        self.concurrency = concurrency
+        self.rate = rate
+        self.retries = retries
+        self.backoff = backoff
+        self._lock = Lock()
+        self._next_delete = 0
+
+    def _list_sessions(self):
+        sessions = []
+        for rows in self.rest._iter_collection_pages('simulation_session'):
+            sessions += rows
+        return sessions
+
+    def plan(self):
+        return self.policy.split(self._list_sessions(),
+                                 self.rest._get_main_session())
+
+    def _throttle(self):
+        if not self.rate:
+            return
+        with self._lock:
+            now = time.monotonic()
+            wait = self._next_delete - now
+            self._next_delete = max(now, self._next_delete) + 1 / self.rate
+        if wait > 0:
+            time.sleep(wait)
+
+    def _delete(self, simulation_session_id):
+        for attempt in range(self.retries + 1):
+            self._throttle()
+            try:
+                answer = self.rest.delete_simulation(simulation_session_id)
+                if not (isinstance(answer, dict) and answer.get('errors')):
+                    return True
+                error = answer['errors']
+            except Exception as exc:
+                error = exc
+            if attempt < self.retries:
+                time.sleep(self.backoff * 2 ** attempt)
+        self._logger.warning(
+            f'Не удалось удалить расчет {simulation_session_id}: {error!r}'
+        )
+        return False
+
+    def apply(self, dry_run=False):
+        if not dry_run:
+            self.policy.ensure_keeps()
+        started = time.perf_counter()
+        kept, deleted = self.plan()
+        if dry_run:
+            self._logger.info('Будут удалены расчеты ({}): {}'.format(
+                len(deleted), ', '.join(str(row['id']) for row in deleted)
+            ))
+            return RetentionReport(len(kept), len(deleted), 0,
+                                   time.perf_counter() - started, True)
+
+        failed = 0
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor, \
+                tqdm(desc='Удаление расчетов', total=len(deleted)) as pbar:
+            for done in executor.map(self._delete,
+                                     [row['id'] for row in deleted]):
+                failed += not done
+                pbar.update(1)
+        report = RetentionReport(len(kept), len(deleted) - failed, failed,
+                                 time.perf_counter() - started, False)
+        self.rest.metrics.inc('sessions_deleted_total', report.deleted)
+        self._logger.info(
+            'Удалено расчетов: {}, не удалось: {}, оставлено: {}, '
+            '{:.1f} с ({:.1f} в секунду)'.format(
+                report.deleted, report.failed, report.kept, report.seconds,
+                report.deleted / report.seconds if report.seconds else 0
+            )
+        )
+        return report
@@ -0,0 +1,114 @@
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from itertools import product
+
+from tqdm import tqdm
+
+from base.base import Base
+
+__all__ = [
+    'SimulationSweep',
+    'SweepResult',
+    'scenario_grid',
+]
+
+SweepResult = namedtuple(
+    'SweepResult',
+    ['scenario', 'simulation_session_id', 'status', 'started', 'seconds',
+     'error']
+)
+
+
+def scenario_grid(**params):
+    """
+    Every combination of the given start_simulation arguments; a list
+    (or tuple) is a swept dimension, anything else is used as is:
+
+        scenario_grid(plan_id=1, ..., sim_period=[30, 60], start_time=[0, 3])
+    """
+    keys = list(params)
+    dimensions = [
+        value if isinstance(value, (list, tuple)) else (value,)
+        for value in params.values()
+    ]
+    return [dict(zip(keys, values)) for values in product(*dimensions)]
+
+
+class SimulationSweep(Base):
+    """
+    Runs many simulations through one IARest: at most `concurrency` of them
+    are started and awaited at a time, each one's completion comes from
+    the shared websocket event stream (with a status check every
+    `poll_interval` seconds as a fallback).
+
+    `run` returns a SweepResult per scenario in the given order. With
+    `best`, a function of a SweepResult that returns a score (lower is
+    better), the best successful run is made primary; with `cleanup`, every
+    other run is deleted.
+    """
+
+    def __init__(self, rest, concurrency=2, poll_interval=300, *args,
+                 **kwargs):
+        super().__init__(*args, **kwargs)
+        self.rest = rest
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+
+    def _run_one(self, scenario):
+        started = time.time()
+        clock = time.perf_counter()
+        simulation_session_id = status = error = None
+        try:
+            simulation_session_id = self.rest.start_simulation(**scenario)
+            status = self.rest.accept_simulation(
+                simulation_session_id, accept=False,
+                poll_interval=self.poll_interval
+            )
+        except Exception as exc:
+            error = repr(exc)
+            self._logger.warning(f'Расчет {scenario} не выполнен: {error}')
+        seconds = time.perf_counter() - clock
+        self.rest.metrics.observe('simulation_seconds', seconds)
+        return SweepResult(scenario, simulation_session_id, status, started,
+                           seconds, error)
+
+    def run(self, scenarios, best=None, cleanup=False):
+        scenarios = list(scenarios)
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            futures = [executor.submit(self._run_one, scenario)
+                       for scenario in scenarios]
+            with tqdm(desc='Расчеты', total=len(futures)) as pbar:
+                results = []
+                for future in futures:
+                    results.append(future.result())
+                    pbar.update(1)
+        elapsed = time.perf_counter() - started
+        self._logger.info(
+            'Выполнено расчетов: {} за {:.0f} с (последовательно было бы '
+            '{:.0f} с)'.format(
+                len(results), elapsed,
+                sum(result.seconds for result in results)
+            )
+        )
+
+        accepted = None
+        succeeded = [result for result in results if result.status == 0]
+        if best is not None and succeeded:
+            accepted = min(succeeded, key=best)
+            self.rest.set_primary_simulation(
+                accepted.simulation_session_id
+            )
+            self._logger.info(
+                f'Принят расчет {accepted.simulation_session_id} '
+                f'({accepted.scenario})'
+            )
+        if cleanup:
+            for result in results:
+                if result is not accepted and \
+                        result.simulation_session_id is not None:
+                    self.rest.delete_simulation(
+                        result.simulation_session_id
+                    )
+        return results
@@ -0,0 +1,273 @@
+from array import array
+from collections.abc import Mapping
+from sys import intern
+
+__all__ = [
+    'CollectionTable',
+    'Row',
+]
+
+_INT64_MIN = -(1 << 63)
+_INT64_MAX = (1 << 63) - 1
+
+_NUMPY_DTYPES = {
+    'q': 'int64',
+    'd': 'float64',
+}
+
+
+class _Column(object):
+    """
+    One column of a CollectionTable. Starts untyped and settles on the type
+    of its first non-null value: 'q' (int64 array), 'd' (float64 array) or
+    'o' (list with interned strings). A value that does not fit the array
+    turns the column into 'o' once, so values always come back unchanged.
+    Nulls in arrays are kept in a bytearray mask created on the first one.
+    """
+
+    __slots__ = ('kind', 'values', 'nulls', 'length')
+
+    def __init__(self, leading_nulls=0):
+        self.kind = None
+        self.values = None
+        self.nulls = None
+        self.length = leading_nulls
+
+    def __len__(self):
+        return self.length
+
+    @staticmethod
+    def _kind_of(value):
+        if type(value) is int and _INT64_MIN <= value <= _INT64_MAX:
+            return 'q'
+        if type(value) is float:
+            return 'd'
+        return 'o'
+
+    def _settle(self, kind):
+        self.kind = kind
+        if kind == 'o':
+            self.values = [None] * self.length
+        else:
+            self.values = array(kind, bytes(self.length * 8))
+            if self.length:
+                self.nulls = bytearray(b'\x01' * self.length)
+
+    def _to_objects(self):
+        values, nulls = self.values, self.nulls
+        if nulls is None:
+            self.values = values.tolist()
+        else:
+            self.values = [
+                None if is_null else value
+                for value, is_null in zip(values, nulls)
+            ]
+        self.kind = 'o'
+        self.nulls = None
+
+    def append(self, value):
+        kind = self.kind
+        if kind is None:
+            if value is None:
+                self.length += 1
+                return
+            self._settle(self._kind_of(value))
+            kind = self.kind
+        if kind == 'o':
+            self.values.append(
+                intern(value) if type(value) is str else value
+            )
+        elif value is None:
+            self.values.append(0)
+            if self.nulls is None:
+                self.nulls = bytearray(self.length)
+            self.nulls.append(1)
+        elif self._kind_of(value) == kind:
+            self.values.append(value)
+            if self.nulls is not None:
+                self.nulls.append(0)
+        else:
+            self._to_objects()
+            self.values.append(
+                intern(value) if type(value) is str else value
+            )
+        self.length += 1
+
+    def get(self, index):
+        if self.kind is None:
+            return None
+        if self.nulls is not None and self.nulls[index]:
+            return None
+        return self.values[index]
+
+
+class Row(Mapping):
+    """Read-only dict-like view of one table row."""
+
+    __slots__ = ('_columns', '_index')
+
+    def __init__(self, columns, index):
+        self._columns = columns
+        self._index = index
+
+    def __getitem__(self, key):
+        return self._columns[key].get(self._index)
+
+    def __iter__(self):
+        return iter(self._columns)
+
+    def __len__(self):
+        return len(self._columns)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+class CollectionTable(object):
+    """
+    Column-oriented storage for collection rows: integer and float fields
+    live in typed arrays with a null mask, strings are interned, so a table
+    costs a few bytes per value instead of a dict per row.
+
+    Behaves like a read-only list of dict-like rows (`len`, iteration,
+    `table[i]`), `table['field']` returns one column as a list and
+    `table[a:b]` returns a view sharing the storage. A field missing from a
+    row reads as None. Views cannot be extended.
+    """
+
+    def __init__(self, rows=(), name=None):
+        self.name = name
+        self._columns = {}
+        self._length = 0
+        self._index = None
+        self.extend(rows)
+
+    @classmethod
+    def _view(cls, table, index):
+        view = cls.__new__(cls)
+        view.name = table.name
+        view._columns = table._columns
+        view._length = len(index)
+        view._index = index
+        return view
+
+    @property
+    def columns(self):
+        return list(self._columns)
+
+    def extend(self, rows):
+        if self._index is not None:
+            raise TypeError('Срез таблицы нельзя дополнять')
+        columns = self._columns
+        length = self._length
+        for row in rows:
+            for key, value in row.items():
+                column = columns.get(key)
+                if column is None:
+                    column = columns[key] = _Column(length)
+                column.append(value)
+            if len(row) != len(columns):
+                for column in columns.values():
+                    if column.length == length:
+                        column.append(None)
+            length += 1
+            self._length = length
+        return self
+
+    def __iadd__(self, rows):
+        return self.extend(rows)
+
+    def __len__(self):
+        return self._length
+
+    def _position(self, index):
+        if self._index is None:
+            return index
+        return self._index[index]
+
+    def __iter__(self):
+        columns = self._columns
+        if self._index is None:
+            return (Row(columns, index) for index in range(self._length))
+        return (Row(columns, index) for index in self._index)
+
+    def __getitem__(self, item):
+        if isinstance(item, str):
+            return self.column(item)
+        if isinstance(item, slice):
+            index = self._index or range(self._length)
+            return self._view(self, index[item])
+        if item < 0:
+            item += self._length
+        if not 0 <= item < self._length:
+            raise IndexError(item)
+        return Row(self._columns, self._position(item))
+
+    def __repr__(self):
+        return '<CollectionTable {} rows={} columns={}>'.format(
+            self.name, self._length, len(self._columns)
+        )
+
+    def column(self, name):
+        column = self._columns[name]
+        if self._index is None and column.kind == 'o':
+            return list(column.values)
+        index = self._index or range(self._length)
+        return [column.get(position) for position in index]
+
+    def to_dicts(self):
+        return [dict(row) for row in self]
+
+    def copy(self):
+        """Compact copy of the table (or of the rows of a view)."""
+        return CollectionTable(self, name=self.name)
+
+    def __getstate__(self):
+        table = self if self._index is None else self.copy()
+        return {
+            'name': table.name,
+            'columns': table._columns,
+            'length': table._length,
+        }
+
+    def __setstate__(self, state):
+        self.name = state['name']
+        self._columns = state['columns']
+        self._length = state['length']
+        self._index = None
+
+    def to_numpy(self, name=None):
+        """
+        Returns one column (or a dict of all columns) as NumPy arrays:
+        int64/float64 arrays sharing memory with the table, masked where
+        there are nulls, and object arrays for everything else. The table
+        must not be extended while such arrays are alive. Requires numpy.
+        """
+        import numpy
+
+        if name is None:
+            return {column: self.to_numpy(column) for column in self._columns}
+
+        column = self._columns[name]
+        index = self._index or range(self._length)
+        if column.kind in _NUMPY_DTYPES and len(column):
+            dtype = _NUMPY_DTYPES[column.kind]
+            values = numpy.frombuffer(column.values, dtype=dtype)
+            values = values[_as_slice(index)]
+            if column.nulls is None:
+                return values
+            mask = numpy.frombuffer(column.nulls, dtype=numpy.bool_)
+            return numpy.ma.masked_array(values, mask=mask[_as_slice(index)])
+        values = numpy.empty(len(index), dtype=object)
+        for position, value in enumerate(self.column(name)):
+            values[position] = value
+        return values
+
+
+def _as_slice(index):
+    if not index:
+        return slice(0, 0)
+    stop = index.stop
+    if stop < 0:
+        stop = None
+    return slice(index.start, stop, index.step)
@@ -0,0 +1,62 @@
+from requests import Session
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+__all__ = [
+    'TimeoutSession',
+    'make_session',
+]
+
+_RETRY_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS'])
+_RETRY_STATUSES = (502, 503, 504)
+
+
+class TimeoutSession(Session):
+    """requests.Session that applies a default timeout to every request."""
+
+    def __init__(self, timeout=None):
+        super().__init__()
+        self.timeout = timeout
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        return super().request(method, url, **kwargs)
+
+
+def make_session(pool_size=10, retries=3, backoff_factor=0.5,
+                 backoff_jitter=0.5, backoff_max=30,
+                 status_forcelist=_RETRY_STATUSES, timeout=(10, 300)):
+    """
+    Builds the HTTP session used by IARest: a keep-alive connection pool of
+    `pool_size` connections per host, gzip/deflate negotiation, and
+    retries with exponential backoff and jitter for idempotent requests
+    only (connection errors and `status_forcelist` responses).
+    """
+    session = TimeoutSession(
+        tuple(timeout) if isinstance(timeout, list) else timeout
+    )
+    adapter = HTTPAdapter(
+        pool_connections=pool_size,
+        pool_maxsize=pool_size,
+        max_retries=Retry(
+            total=retries,
+            connect=retries,
+            read=retries,
+            status=retries,
+            other=0,
+            allowed_methods=_RETRY_METHODS,
+            status_forcelist=status_forcelist,
+            backoff_factor=backoff_factor,
+            backoff_jitter=backoff_jitter,
+            backoff_max=backoff_max,
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        ),
+    )
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.headers.update({
+        'Accept-Encoding': 'gzip, deflate',
+        'Connection': 'keep-alive',
+    })
+    return session
@@ -0,0 +1,100 @@
+import os
+import uuid
+import zlib
+from mimetypes import guess_type
+
+__all__ = [
+    'MultipartFile',
+    'gzip_chunks',
+]
+
+_CHUNK_SIZE = 1 << 20
+
+
+class MultipartFile(object):
+    """
+    multipart/form-data body with a single file field, read from disk in
+    `chunk_size` blocks while it is sent, so memory use does not depend on
+    the file size. Its length is known in advance, so requests sends it
+    with a Content-Length rather than chunked.
+
+        body = MultipartFile(path)
+        session.post(url, data=body,
+                     headers={'Content-Type': body.content_type})
+    """
+
+    def __init__(self, path, field='data', filename=None, content_type=None,
+                 chunk_size=_CHUNK_SIZE):
+        self.path = path
+        self.chunk_size = chunk_size
+        boundary = uuid.uuid4().hex
+        filename = (path if filename is None else filename).replace(
+            '"', '%22'
+        )
+        content_type = content_type or guess_type(path)[0] or \
+            'application/octet-stream'
+        self.content_type = f'multipart/form-data; boundary={boundary}'
+        self._head = (
+            f'--{boundary}\r\n'
+            f'Content-Disposition: form-data; name="{field}"; '
+            f'filename="{filename}"\r\n'
+            f'Content-Type: {content_type}\r\n\r\n'
+        ).encode('utf-8')
+        self._tail = f'\r\n--{boundary}--\r\n'.encode('ascii')
+        self._length = len(self._head) + os.path.getsize(path) + \
+            len(self._tail)
+        self._file = None
+        self._stage = 0
+
+    def __len__(self):
+        return self._length
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self._length
+        chunks = []
+        while size > 0 and self._stage < 3:
+            if self._stage == 0:
+                chunk, self._head = self._head[:size], self._head[size:]
+                if not self._head:
+                    self._stage = 1
+                    self._file = open(self.path, 'rb')
+            elif self._stage == 1:
+                chunk = self._file.read(size)
+                if len(chunk) < size:
+                    self._file.close()
+                    self._stage = 2
+            else:
+                chunk, self._tail = self._tail[:size], self._tail[size:]
+                if not self._tail:
+                    self._stage = 3
+            chunks.append(chunk)
+            size -= len(chunk)
+        return b''.join(chunks)
+
+    def __iter__(self):
+        while True:
+            chunk = self.read(self.chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def gzip_chunks(chunks, compresslevel=6):
+    """Gzip-compresses a stream of byte chunks on the fly."""
+    compressor = zlib.compressobj(compresslevel, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
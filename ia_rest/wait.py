@@ -0,0 +1,173 @@
+import random
+import time
+from threading import Event
+
+from base.base import Base
+
+__all__ = [
+    'WaitCancelled',
+    'Waiter',
+]
+
+_CANCEL_CHECK_INTERVAL = 0.5
+
+
+class WaitCancelled(Exception):
+    pass
+
+
+def _is_not_none(result):
+    return result is not None
+
+
+class Waiter(Base):
+    """
+    Polls `check` until `done(check())` holds, sleeping between attempts
+    `initial`, `initial * factor`, ... seconds up to `max_interval`, each
+    delay spread by +-`jitter` (a fraction of it).
+
+    A wait ends with TimeoutError after `timeout` seconds and with
+    WaitCancelled once `cancel` (a threading.Event) is set, at most
+    `cancel_check_interval` seconds later. With `subscription` (see
+    events.Subscription) any message it receives cuts the current delay
+    short and triggers the next check at once; the message itself is left
+    in the subscription for `check` to read. The time
+    spent is recorded under `reason` in `metrics`.
+
+    `reasons` overrides `initial`, `max_interval` and `timeout` of the
+    waits with the given reason, e.g. {'static_report': {'initial': 10}}.
+    """
+
+    def __init__(self, initial=1, factor=2, max_interval=60, jitter=0.2,
+                 metrics=None, cancel=None, reasons=None,
+                 cancel_check_interval=_CANCEL_CHECK_INTERVAL, *args,
+                 **kwargs):
+        super().__init__(*args, **kwargs)
+        self.initial = initial
+        self.factor = factor
+        self.max_interval = max_interval
+        self.jitter = jitter
+        self.metrics = metrics
+        self.cancel = cancel or Event()
+        self.reasons = reasons or {}
+        self.cancel_check_interval = cancel_check_interval
+
+    def delays(self, initial=None, max_interval=None):
+        delay = self.initial if initial is None else initial
+        max_interval = self.max_interval if max_interval is None \
+            else max_interval
+        while True:
+            delay = min(delay, max_interval)
+            yield delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+            delay *= self.factor
+
+    def _pause(self, delay, subscription):
+        if subscription is None:
+            self.cancel.wait(delay)
+        else:
+            # a subscription cannot be woken by `cancel`, so it is waited
+            # for in short slices
+            deadline = time.monotonic() + delay
+            while not self.cancel.is_set():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or subscription.wait(
+                        min(remaining, self.cancel_check_interval)):
+                    break
+        if self.cancel.is_set():
+            raise WaitCancelled()
+
+    def _settings(self, reason, timeout, initial, max_interval):
+        settings = self.reasons.get(reason, {})
+        return (settings.get('timeout', timeout),
+                settings.get('initial', initial),
+                settings.get('max_interval', max_interval))
+
+    @staticmethod
+    def _bounded(delay, deadline, reason, timeout):
+        if deadline is None:
+            return delay
+        remaining = deadline - time.perf_counter()
+        if remaining <= 0:
+            raise TimeoutError(f'Ожидание {reason} дольше {timeout} с')
+        return min(delay, remaining)
+
+    def _record(self, reason, started):
+        if self.metrics is not None:
+            seconds = time.perf_counter() - started
+            self.metrics.inc('wait_seconds_total', seconds, reason=reason)
+            self.metrics.observe('wait_duration_seconds', seconds,
+                                 reason=reason)
+
+    def poll(self, check, reason, done=_is_not_none, timeout=None,
+             subscription=None, initial=None, max_interval=None,
+             on_retry=None):
+        """
+        Returns the first result of `check` accepted by `done`. `on_retry`
+        is called with that result and the next delay before every pause.
+        """
+        timeout, initial, max_interval = self._settings(
+            reason, timeout, initial, max_interval
+        )
+        started = time.perf_counter()
+        deadline = None if timeout is None else started + timeout
+        delays = self.delays(initial, max_interval)
+        try:
+            while True:
+                result = check()
+                if done(result):
+                    return result
+                delay = self._bounded(next(delays), deadline, reason, timeout)
+                if on_retry is not None:
+                    on_retry(result, delay)
+                self._pause(delay, subscription)
+        finally:
+            self._record(reason, started)
+
+    async def apoll(self, check, reason, done=_is_not_none, timeout=None,
+                    subscription=None, initial=None, max_interval=None,
+                    on_retry=None):
+        """
+        `poll` for asyncio: `check` is a coroutine function and
+        `subscription.wait(timeout)` a coroutine.
+        """
+        import asyncio
+
+        timeout, initial, max_interval = self._settings(
+            reason, timeout, initial, max_interval
+        )
+        started = time.perf_counter()
+        deadline = None if timeout is None else started + timeout
+        delays = self.delays(initial, max_interval)
+        try:
+            while True:
+                result = await check()
+                if done(result):
+                    return result
+                delay = self._bounded(next(delays), deadline, reason, timeout)
+                if on_retry is not None:
+                    on_retry(result, delay)
+                pause_until = time.monotonic() + delay
+                while not self.cancel.is_set():
+                    remaining = pause_until - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    remaining = min(remaining, self.cancel_check_interval)
+                    if subscription is None:
+                        await asyncio.sleep(remaining)
+                    elif await subscription.wait(remaining):
+                        break
+                if self.cancel.is_set():
+                    raise WaitCancelled()
+        finally:
+            self._record(reason, started)
+
+    @classmethod
+    def from_config(cls, config, metrics=None):
+        return cls(
+            initial=config.get('initial', 1),
+            factor=config.get('factor', 2),
+            max_interval=config.get('max_interval', 60),
+            jitter=config.get('jitter', 0.2),
+            metrics=metrics,
+            reasons=config.get('reasons'),
+        )
@@ -1,12 +1,17 @@
-import subprocess
+import time
 from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
 from os import getcwd
 from os.path import join
+from threading import Thread
 
 import yaml
-from tqdm import tqdm
 
 from ia_rest.iarest import IARest
+from runner.scripts import DONE, OK, ScriptRunner, read_scripts
+from runner.state import StateLocked, StateStore
+from utils.console import write
+from utils.metrics import REGISTRY
 
 
 def read_yml(filename):
@@ -15,47 +20,242 @@ def read_yml(filename):
     return result
 
 
-def write_to_yml(data, filename):
-    with open(filename, 'w', encoding="utf-8") as stream:
-        yaml.dump(data, stream)
+def read_instances_from_yml(filename):
+    """
+    Returns the watched IA instances. `IA` is either one mapping (scripts
+    and scripts_concurrency at the top level, state at the top level of
+    session.yml) or a list of mappings, each with its own `name`, `scripts`
+    and optional `scripts_concurrency`.
+    """
+    config = read_yml(filename)
+    if isinstance(config['IA'], dict):
+        return [{
+            'name': None,
+            'IA': config['IA'],
+            'scripts': config['scripts'],
+            'scripts_concurrency': config.get('scripts_concurrency', 1),
+        }]
+    instances = []
+    for ia_config in config['IA']:
+        instances.append({
+            'name': str(ia_config.get('name', ia_config['url'])),
+            'IA': ia_config,
+            'scripts': ia_config.get('scripts', config.get('scripts')),
+            'scripts_concurrency': ia_config.get(
+                'scripts_concurrency',
+                config.get('scripts_concurrency', 1)
+            ),
+        })
+    return instances
 
 
-def read_script_from_yml(filename):
-    return read_yml(filename)['scripts']
+def export_metrics(config):
+    try:
+        REGISTRY.export(read_yml(config).get('metrics') or {})
+    except OSError as error:
+        write(f'Не удалось сохранить метрики: {error!r}')
 
 
-def read_session_from_yml(filename):
-    return read_yml(filename)['session']
+def read_session_from_yml(filename, instance=None):
+    return StateStore(filename).read_section(instance).get('session')
 
 
-def save_session_to_yml(session, filename):
-    write_to_yml({'session': session}, filename)
+def save_session_to_yml(session, filename, instance=None):
+    def save(state):
+        state.clear()
+        state['session'] = session
+
+    StateStore(filename).update(instance, save)
 
 
 def read_session_from_rest(config):
     with IARest.from_config(config) as ia:
-        ia._perform_login()
         session = ia._get_main_session()
     return session
 
 
+def _make_write(instance):
+    if instance['name'] is None:
+        return write
+    return lambda text: write(f"[{instance['name']}] {text}")
+
+
+def check_instance(store, instance):
+    write = _make_write(instance)
+    label = instance['name'] or 'default'
+    try:
+        with REGISTRY.timer('check_seconds', instance=label):
+            new_session = read_session_from_rest(instance['IA'])
+    except Exception as error:
+        REGISTRY.inc('check_errors_total', instance=label)
+        write(f'Не удалось получить главный расчет: {error!r}')
+        return
+    if new_session is not None:
+        REGISTRY.set('primary_session', new_session, instance=label)
+    run_if_new_session(store, instance, new_session)
+
+
 def start_script(session_config, config):
-    old_session = read_session_from_yml(session_config)
-    new_session = read_session_from_rest(read_yml(config)['IA'])
+    store = StateStore(session_config)
+    instances = read_instances_from_yml(config)
+    try:
+        if len(instances) == 1:
+            check_instance(store, instances[0])
+            return
+        with ThreadPoolExecutor(max_workers=len(instances)) as executor:
+            for future in [
+                executor.submit(check_instance, store, instance)
+                for instance in instances
+            ]:
+                future.result()
+    finally:
+        export_metrics(config)
+
+
+def run_if_new_session(store, instance, new_session):
+    try:
+        with store.lock(instance['name']):
+            _run_if_new_session(store, instance, new_session)
+    except StateLocked:
+        _make_write(instance)('Скрипты уже выполняются другим процессом')
+
+
+def _run_if_new_session(store, instance, new_session):
+    name = instance['name']
+    write = _make_write(instance)
+    state = store.read_section(name)
+    old_session = state.get('session')
     if old_session == new_session:
-        tqdm.write('Новой сессии не появилось')
+        write('Новой сессии не появилось')
         return
     if new_session is None:
-        tqdm.write('Нет принятого расчета')
+        write('Нет принятого расчета')
         return
-    tqdm.write(f"Появилась новый главный расчет номер {new_session}, "
-               f"раньше главный расчет был {old_session}")
-    scripts = read_script_from_yml(config)
-    for script in scripts:
-        tqdm.write(f"Запускаем скрипт {script}")
-        subprocess.call(script, shell=True)
-    tqdm.write(f"Все скрипты отработали")
-    save_session_to_yml(new_session, session_config)
+    write(f"Появилась новый главный расчет номер {new_session}, "
+          f"раньше главный расчет был {old_session}")
+
+    progress = state.get('progress') or {}
+    completed = set()
+    if progress.get('session') == new_session:
+        completed.update(progress.get('completed') or [])
+
+    def checkpoint(result):
+        label = name or 'default'
+        REGISTRY.set('script_duration_seconds', result.seconds,
+                     instance=label, script=result.name)
+        REGISTRY.set('script_exit_code',
+                     -1 if result.returncode is None else result.returncode,
+                     instance=label, script=result.name)
+        REGISTRY.inc('script_runs_total', instance=label,
+                     script=result.name, status=result.status)
+        REGISTRY.event('script', instance=label, script=result.name,
+                       status=result.status, returncode=result.returncode,
+                       seconds=result.seconds, session=new_session)
+        if result.status != OK:
+            return
+        completed.add(result.name)
+
+        def save(section):
+            section['progress'] = {
+                'session': new_session,
+                'completed': sorted(completed),
+            }
+
+        store.update(name, save)
+
+    scripts = read_scripts(instance['scripts'])
+    results = ScriptRunner(
+        scripts,
+        concurrency=instance['scripts_concurrency'],
+        write=write,
+        completed=completed,
+        on_result=checkpoint
+    ).run()
+
+    failed = [
+        result.name for result in results
+        if result.status not in (OK, DONE)
+    ]
+    if failed:
+        write(f"Не отработали скрипты: {', '.join(failed)}; "
+              f"они будут запущены повторно при следующей проверке")
+        return
+    write(f"Все скрипты отработали")
+    save_session_to_yml(new_session, store.path, name)
+
+
+def watch(session_config, config):
+    """
+    Watches every configured instance in its own thread, see
+    watch_instance.
+    """
+    store = StateStore(session_config)
+    daemon_config = read_yml(config).get('daemon') or {}
+    instances = read_instances_from_yml(config)
+    if len(instances) == 1:
+        watch_instance(store, instances[0], daemon_config, config)
+        return
+    threads = [
+        Thread(target=watch_instance,
+               args=(store, instance, daemon_config, config),
+               name=instance['name'],
+               daemon=True)
+        for instance in instances
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def watch_instance(store, instance, daemon_config, config=None):
+    """
+    Keeps one authenticated IARest, checks the primary session whenever a
+    matching websocket event arrives, after every reconnect of the shared
+    event stream and every `poll_interval` seconds otherwise.
+    """
+    from ia_rest.events import RECONNECTED
+
+    write = _make_write(instance)
+    poll_interval = daemon_config.get('poll_interval', 600)
+    events = set(daemon_config.get(
+        'events', ['PRIMARY_SIMULATION_SESSION_CHANGED']
+    ))
+
+    with IARest.from_config(instance['IA']) as ia:
+        ia.events.max_backoff = daemon_config.get('max_backoff', 300)
+        last_check = 0
+
+        def check():
+            nonlocal last_check
+            last_check = time.monotonic()
+            try:
+                new_session = ia._get_main_session()
+            except Exception as error:
+                write(f'Не удалось получить главный расчет: {error!r}')
+                return
+            # the daemon must outlive any failure of a single check
+            try:
+                run_if_new_session(store, instance, new_session)
+            except Exception as error:
+                write(f'Ошибка при обработке расчета {new_session}: '
+                      f'{error!r}')
+            try:
+                if config is not None:
+                    export_metrics(config)
+            except Exception as error:
+                write(f'Не удалось сохранить метрики: {error!r}')
+
+        with ia.events.subscribe(events | {RECONNECTED}) as subscription:
+            check()
+            while True:
+                try:
+                    subscription.get(max(
+                        0, poll_interval - (time.monotonic() - last_check)
+                    ))
+                except TimeoutError:
+                    pass
+                check()
 
 
 if __name__ == '__main__':
@@ -68,7 +268,14 @@ if __name__ == '__main__':
     parser.add_argument('-s', '--session', required=False,
                         default=join(getcwd(), 'session.yml'))
 
+    parser.add_argument('-d', '--daemon', action='store_true',
+                        help='Не завершаться, а следить за сменой главного '
+                             'расчета через websocket')
+
     args = parser.parse_args()
 
-    start_script(args.session, args.config)
+    if args.daemon:
+        watch(args.session, args.config)
+    else:
+        start_script(args.session, args.config)
 
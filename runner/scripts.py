@@ -0,0 +1,261 @@
+import os
+import signal
+import subprocess
+import time
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from threading import Lock, Timer
+
+from base.base import Base
+from utils.console import write as console_write
+
+__all__ = [
+    'Script',
+    'ScriptResult',
+    'ScriptRunner',
+    'read_scripts',
+]
+
+ScriptResult = namedtuple(
+    'ScriptResult',
+    ['name', 'status', 'returncode', 'seconds']
+)
+
+OK = 'ok'
+DONE = 'done'
+FAILED = 'failed'
+TIMEOUT = 'timeout'
+SKIPPED = 'skipped'
+
+
+class Script(object):
+    """
+    One entry of the `scripts` config section.
+
+    `after` lists scripts that must succeed before this one starts,
+    `order_after` only has to be finished (that is how plain string entries
+    keep today's one-after-another behaviour).
+    """
+
+    def __init__(self, name, command, after=(), order_after=(),
+                 timeout=None, env=None):
+        self.name = name
+        self.command = command
+        self.after = tuple(after)
+        self.order_after = tuple(order_after)
+        self.timeout = timeout
+        self.env = env or {}
+
+    @property
+    def dependencies(self):
+        return self.after + self.order_after
+
+    def __repr__(self):
+        return '{}({!r})'.format(self.__class__.__name__, self.name)
+
+
+def _unique_name(name, used):
+    if name not in used:
+        return name
+    number = 2
+    while f'{name}#{number}' in used:
+        number += 1
+    return f'{name}#{number}'
+
+
+def read_scripts(config_scripts):
+    """
+    Builds Script objects from the `scripts` config section. An entry is
+    either a command string or a mapping with `run` and optional `name`,
+    `after`, `timeout` and `env`. Entries without `after` run after the
+    previous entry, so plain lists keep running one by one.
+    """
+    scripts = []
+    used = set()
+    previous = None
+    for entry in config_scripts or []:
+        if isinstance(entry, str):
+            entry = {'run': entry}
+        name = _unique_name(str(entry.get('name', entry['run'])), used)
+        used.add(name)
+        if 'after' in entry:
+            after = entry['after'] or []
+            if isinstance(after, str):
+                after = [after]
+            order_after = ()
+        else:
+            after = ()
+            order_after = () if previous is None else (previous,)
+        scripts.append(Script(
+            name,
+            entry['run'],
+            after=after,
+            order_after=order_after,
+            timeout=entry.get('timeout'),
+            env={
+                str(key): str(value)
+                for key, value in (entry.get('env') or {}).items()
+            },
+        ))
+        previous = name
+
+    for script in scripts:
+        for dependency in script.dependencies:
+            if dependency not in used:
+                raise ValueError(
+                    'Скрипт {!r} зависит от неизвестного скрипта {!r}'.format(
+                        script.name, dependency
+                    )
+                )
+    _check_acyclic(scripts)
+    return scripts
+
+
+def _check_acyclic(scripts):
+    by_name = {script.name: script for script in scripts}
+    state = {}
+
+    def visit(name):
+        if state.get(name) == 'done':
+            return
+        if state.get(name) == 'active':
+            raise ValueError(
+                'Циклическая зависимость скриптов через {!r}'.format(name)
+            )
+        state[name] = 'active'
+        for dependency in by_name[name].dependencies:
+            visit(dependency)
+        state[name] = 'done'
+
+    for script in scripts:
+        visit(script.name)
+
+
+class ScriptRunner(Base):
+
+    def __init__(self, scripts, concurrency=1, write=console_write,
+                 completed=(), on_result=None, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.scripts = list(scripts)
+        self.concurrency = max(1, concurrency or 1)
+        self.completed = set(completed)
+        self.on_result = on_result
+        self._write = write
+        self._write_lock = Lock()
+
+    def write(self, text):
+        with self._write_lock:
+            self._write(text)
+
+    @staticmethod
+    def _kill(process):
+        try:
+            if hasattr(os, 'killpg'):
+                os.killpg(process.pid, signal.SIGKILL)
+            else:
+                process.kill()
+        except (ProcessLookupError, PermissionError):
+            pass
+
+    def _run_script(self, script):
+        self.write(f"Запускаем скрипт {script.name}")
+        started = time.perf_counter()
+        process = subprocess.Popen(
+            script.command,
+            shell=True,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            env={**os.environ, **script.env},
+            encoding='utf-8',
+            errors='replace',
+            start_new_session=hasattr(os, 'killpg'),
+        )
+        timed_out = []
+        timer = None
+        if script.timeout is not None:
+            def on_timeout():
+                timed_out.append(True)
+                self._kill(process)
+
+            timer = Timer(script.timeout, on_timeout)
+            timer.daemon = True
+            timer.start()
+        try:
+            for line in process.stdout:
+                self.write(f'[{script.name}] {line.rstrip()}')
+            returncode = process.wait()
+        finally:
+            if timer is not None:
+                timer.cancel()
+            process.stdout.close()
+
+        seconds = time.perf_counter() - started
+        if timed_out:
+            status = TIMEOUT
+        elif returncode == 0:
+            status = OK
+        else:
+            status = FAILED
+        return ScriptResult(script.name, status, returncode, seconds)
+
+    def run(self):
+        pending = {}
+        results = {}
+        running = {}
+        for script in self.scripts:
+            if script.name in self.completed:
+                results[script.name] = ScriptResult(script.name, DONE,
+                                                    0, 0.0)
+                self.write(f"Скрипт {script.name} уже выполнен "
+                           f"для этого расчета")
+            else:
+                pending[script.name] = script
+
+        def blocked(script):
+            return any(
+                results[name].status not in (OK, DONE)
+                for name in script.after
+                if name in results
+            )
+
+        def ready(script):
+            return all(name in results for name in script.dependencies)
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            while pending or running:
+                for name, script in list(pending.items()):
+                    if blocked(script):
+                        del pending[name]
+                        results[name] = ScriptResult(name, SKIPPED, None, 0.0)
+                        self.write(f"Скрипт {name} пропущен: не выполнены "
+                                   f"зависимости {', '.join(script.after)}")
+                    elif ready(script) and len(running) < self.concurrency:
+                        del pending[name]
+                        running[executor.submit(self._run_script,
+                                                script)] = script
+                if not running:
+                    continue
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    script = running.pop(future)
+                    try:
+                        result = future.result()
+                    except OSError as error:
+                        self._logger.error('Не удалось запустить скрипт '
+                                           '{}: {!r}'.format(script.name,
+                                                             error))
+                        result = ScriptResult(script.name, FAILED, None, 0.0)
+                    results[script.name] = result
+                    if self.on_result is not None:
+                        self.on_result(result)
+
+        self.report(results)
+        return [results[script.name] for script in self.scripts]
+
+    def report(self, results):
+        for script in self.scripts:
+            result = results[script.name]
+            self.write(
+                f"Скрипт {result.name}: {result.status}, "
+                f"код {result.returncode}, {result.seconds:.1f} с"
+            )
@@ -0,0 +1,126 @@
+import hashlib
+import os
+import re
+from contextlib import contextmanager
+from tempfile import NamedTemporaryFile
+from threading import Lock
+
+import yaml
+
+from base.base import Base
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+__all__ = [
+    'StateLocked',
+    'StateStore',
+]
+
+
+_UNSAFE_CHARS = re.compile(r'[^\w.-]+')
+
+
+class StateLocked(RuntimeError):
+    pass
+
+
+def _lock_suffix(instance):
+    """
+    A file-name-safe suffix for the lock of `instance` (which may be a URL):
+    its sanitized name plus a short hash that keeps names distinct.
+    """
+    digest = hashlib.sha1(instance.encode('utf-8')).hexdigest()[:12]
+    return '{}-{}'.format(_UNSAFE_CHARS.sub('_', instance)[:40], digest)
+
+
+@contextmanager
+def _file_lock(path, blocking=False):
+    with open(path, 'a+') as lock_file:
+        try:
+            if fcntl is not None:
+                fcntl.flock(
+                    lock_file,
+                    fcntl.LOCK_EX if blocking else
+                    fcntl.LOCK_EX | fcntl.LOCK_NB
+                )
+            else:
+                lock_file.seek(0)
+                msvcrt.locking(
+                    lock_file.fileno(),
+                    msvcrt.LK_LOCK if blocking else msvcrt.LK_NBLCK,
+                    1
+                )
+        except OSError:
+            raise StateLocked(path)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+            else:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class StateStore(Base):
+    """
+    YAML state file (session.yml) with atomic writes.
+
+    `lock(instance)` is the long-lived inter-process lock held while the
+    scripts of one instance run; `update` serializes read-modify-write
+    cycles of the shared file between threads and processes.
+
+    A single instance (instance=None) keeps its state at the top level of
+    the file, named instances live under `instances`.
+    """
+
+    def __init__(self, path, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.path = path
+        self.lock_path = f'{path}.lock'
+        self._update_lock = Lock()
+
+    def lock(self, instance=None):
+        if instance is None:
+            return _file_lock(self.lock_path)
+        return _file_lock(f'{self.path}.{_lock_suffix(instance)}.lock')
+
+    @staticmethod
+    def section(data, instance=None):
+        if instance is None:
+            return data
+        return data.setdefault('instances', {}).setdefault(instance, {})
+
+    def read_section(self, instance=None):
+        return dict(self.section(self.read(), instance))
+
+    def update(self, instance, func):
+        """
+        Calls func with the state section of `instance` and writes the
+        whole file back; func may modify the section in place.
+        """
+        with self._update_lock, _file_lock(f'{self.path}.write.lock',
+                                           blocking=True):
+            data = self.read()
+            func(self.section(data, instance))
+            self.write(data)
+
+    def read(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as stream:
+                return yaml.load(stream, Loader=yaml.SafeLoader) or {}
+        except FileNotFoundError:
+            return {}
+
+    def write(self, data):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        with NamedTemporaryFile('w', encoding='utf-8', dir=directory,
+                                prefix='.state-', delete=False) as stream:
+            yaml.dump(data, stream)
+            stream.flush()
+            os.fsync(stream.fileno())
+        os.replace(stream.name, self.path)
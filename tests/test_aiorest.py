@@ -0,0 +1,137 @@
+import asyncio
+import time
+
+import pytest
+
+pytest.importorskip('aiohttp')
+
+from bench.fake_bfg import FakeBFG  # noqa: E402
+from ia_rest.aiorest import AsyncIARest  # noqa: E402
+
+
+@pytest.fixture
+def bfg():
+    with FakeBFG(rows=50, simulation_seconds=0.2) as server:
+        yield server
+
+
+def _run(bfg, func, **config):
+    async def main():
+        async with AsyncIARest.from_config(bfg.config(**config)) as ia:
+            return await func(ia)
+
+    return asyncio.run(main())
+
+
+def _add_sessions(bfg):
+    for session_id in range(1, 7):
+        bfg.simulation_sessions[session_id] = {
+            'id': session_id, 'plan_id': 1,
+            'status': None if session_id == 6 else 0,
+        }
+
+
+def test_clean_sessions_keeps_primary_and_running(bfg):
+    _add_sessions(bfg)
+    report = _run(bfg, lambda ia: ia.clean_sessions(2))
+    assert sorted(bfg.simulation_sessions) == [1, 5, 6]
+    assert (report.kept, report.deleted, report.failed) == (3, 3, 0)
+
+
+def test_clean_sessions_without_rules(bfg):
+    _add_sessions(bfg)
+    with pytest.raises(ValueError):
+        _run(bfg, lambda ia: ia.clean_sessions())
+    report = _run(bfg, lambda ia: ia.clean_sessions(dry_run=True))
+    assert report.dry_run and report.deleted == 4
+    assert len(bfg.simulation_sessions) == 6
+
+
+def test_start_and_accept_simulation(bfg):
+    async def simulate(ia):
+        started = time.monotonic()
+        simulation_session_id = await ia.start_simulation(1, 1, 1, 1, 1, 1)
+        status = await ia.accept_simulation(simulation_session_id,
+                                            timeout=10)
+        return simulation_session_id, status, time.monotonic() - started
+
+    simulation_session_id, status, seconds = _run(bfg, simulate)
+    assert status == 0
+    assert bfg.primary_session == simulation_session_id
+    assert seconds < 5
+
+
+def test_accept_after_the_finish_event(bfg):
+    async def simulate(ia):
+        simulation_session_id = await ia.start_simulation(1, 1, 1, 1, 1, 1)
+        await asyncio.sleep(0.5)
+        started = time.monotonic()
+        status = await ia.accept_simulation(simulation_session_id,
+                                            accept=False, timeout=10)
+        return status, time.monotonic() - started
+
+    status, seconds = _run(bfg, simulate)
+    assert status == 0 and seconds < 1
+
+
+def test_accept_missing_simulation(bfg):
+    with pytest.raises(LookupError):
+        _run(bfg, lambda ia: ia.accept_simulation(999, timeout=5))
+
+
+def test_report_wait_backs_off_until_ready():
+    with FakeBFG(rows=20, report_not_ready=2) as bfg:
+        report = _run(
+            bfg,
+            lambda ia: ia._wait_for_trafficlight_report(5, timeout=10),
+            wait={'jitter': 0, 'reasons': {'static_report': {
+                'initial': 0.01, 'max_interval': 0.02
+            }}}
+        )
+    assert report['meta']['count'] == 20
+
+
+def test_report_wait_raises_on_other_errors(bfg):
+    async def wait(ia):
+        async def answer(uri):
+            return {'errors': [{'name': 'SOMETHING_ELSE'}]}
+
+        ia._perform_get = answer
+        return await ia._wait_for_trafficlight_report(5, timeout=10)
+
+    with pytest.raises(RuntimeError):
+        _run(bfg, wait)
+
+
+def test_gateway_errors_are_retried_before_decoding():
+    from aiohttp import web
+
+    answers = [web.Response(status=502, text='<html>Bad gateway</html>'),
+               web.Response(status=503, text='<html>Unavailable</html>'),
+               web.json_response({'data': 'ok'})]
+
+    async def handler(request):
+        return answers.pop(0)
+
+    async def main():
+        app = web.Application()
+        app.router.add_get('/ping', handler)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, '127.0.0.1', 0)
+        await site.start()
+        port = runner.addresses[0][1]
+        try:
+            async with AsyncIARest('login', 'password',
+                                   f'http://127.0.0.1:{port}/',
+                                   f'ws://127.0.0.1:{port}',
+                                   backoff_factor=0.01,
+                                   backoff_jitter=0) as ia:
+                return await ia._perform_json_request(
+                    'GET', 'ping', authenticate=False
+                )
+        finally:
+            await runner.cleanup()
+
+    assert asyncio.run(main()) == {'data': 'ok'}
+    assert answers == []
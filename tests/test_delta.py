@@ -0,0 +1,77 @@
+from ia_rest.delta import DeltaSync
+from ia_rest.iarest import IARest
+from utils.metrics import Metrics
+
+
+class _Rest(object):
+
+    _collection_order = staticmethod(IARest._collection_order)
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.filters = []
+        self.metrics = Metrics(prefix='test')
+
+    def _iter_collection_pages(self, table, filter=None):
+        self.filters.append(filter)
+        rows = self.rows
+        if filter is not None and filter.startswith('id gt '):
+            last_id = int(filter[len('id gt '):])
+            rows = [row for row in rows if row['id'] > last_id]
+        yield list(rows)
+
+    def _fetch_collection_page(self, table, start, stop):
+        return {'meta': {'count': len(self.rows)},
+                table: self.rows[start:stop]}, 0
+
+
+def test_only_configured_tables_are_handled(tmp_path):
+    assert not DeltaSync(str(tmp_path)).handles('simulation_session')
+    delta = DeltaSync(str(tmp_path), tables=['operation'],
+                      changed_since={'department': "updated_at gt '{since}'"})
+    assert delta.handles('operation')
+    assert delta.handles('department')
+    assert not delta.handles('static_session')
+
+
+def test_appended_rows_are_fetched_by_id(tmp_path):
+    rest = _Rest([{'id': 1}, {'id': 2}])
+    delta = DeltaSync(str(tmp_path), tables=['operation'])
+    assert delta.sync(rest, 'operation') == [{'id': 1}, {'id': 2}]
+    rest.rows.append({'id': 3})
+    assert delta.sync(rest, 'operation') == rest.rows
+    assert rest.filters == [None, 'id gt 2']
+
+
+def test_rows_without_id_are_fetched_in_full(tmp_path):
+    rest = _Rest([{'name': 'a'}, {'name': 'b'}])
+    delta = DeltaSync(str(tmp_path), tables=['kind'])
+    assert delta.sync(rest, 'kind') == rest.rows
+    assert delta.load('kind') is None
+    assert delta.sync(rest, 'kind') == rest.rows
+    assert rest.filters == [None, None]
+
+
+def test_snapshot_keeps_the_order_of_a_full_fetch(tmp_path):
+    rest = _Rest([
+        {'id': 1, 'parent_id': 1, 'child_id': 2},
+        {'id': 2, 'parent_id': 2, 'child_id': None},
+        {'id': 3, 'parent_id': 2, 'child_id': 1},
+    ])
+    delta = DeltaSync(str(tmp_path), tables=['specification_item'])
+    delta.sync(rest, 'specification_item')
+    rest.rows.append({'id': 4, 'parent_id': 1, 'child_id': 1})
+    rows = delta.sync(rest, 'specification_item')
+    assert [row['id'] for row in rows] == [4, 1, 3, 2]
+    assert [row['id'] for row in delta.load('specification_item')['rows']] \
+        == [4, 1, 3, 2]
+
+
+def test_changed_rows_are_merged_in_order(tmp_path):
+    rest = _Rest([{'id': 1, 'name': 'a'}, {'id': 3, 'name': 'c'}])
+    delta = DeltaSync(str(tmp_path),
+                      changed_since={'operation': "updated gt '{since}'"})
+    delta.sync(rest, 'operation')
+    rest.rows[:] = [{'id': 1, 'name': 'a'}, {'id': 2, 'name': 'b'},
+                    {'id': 3, 'name': 'C'}]
+    assert delta.sync(rest, 'operation') == rest.rows
@@ -0,0 +1,103 @@
+import pytest
+
+from ia_rest.events import RECONNECTED, Subscription
+from ia_rest.iarest import IARest
+from ia_rest.wait import Waiter
+
+_UUID = 'allocation-uuid'
+
+_BEFORE = [{'type': 0, 'data': {'allocated': True}}]
+
+_AFTER = [{'type': 0, 'data': {'allocated': True, 'date': 'later'}}]
+
+
+class _Stream(object):
+
+    def unsubscribe(self, subscription):
+        pass
+
+
+def _subscription(*messages):
+    subscription = Subscription(_Stream(), ['STATE_ALLOCATION_COMPLETED',
+                                            'STATE_ALLOCATION_FAILED'],
+                                {'state_allocation_session_uuid': _UUID})
+    for message in messages:
+        if subscription.matches(message):
+            subscription.put(message)
+    return subscription
+
+
+def _rest(answer):
+    rest = IARest('login', 'password', 'http://bfg.invalid/',
+                  'ws://bfg.invalid/', credentials=None,
+                  waiter=Waiter(jitter=0, reasons={'state_allocation': {
+                      'initial': 0.01, 'max_interval': 0.02
+                  }}))
+    checks = []
+
+    def perform_action(uri_part, **data):
+        checks.append(uri_part)
+        return {'data': answer}
+
+    rest._perform_action = perform_action
+    return rest, checks
+
+
+def _event(msg, allocation_uuid=_UUID):
+    return {'msg': msg,
+            'data': {'state_allocation_session_uuid': allocation_uuid}}
+
+
+def test_reconnected_reaches_filtered_subscriptions():
+    subscription = _subscription()
+    assert subscription.matches({'msg': RECONNECTED, 'data': None})
+    assert subscription.matches(_event('STATE_ALLOCATION_COMPLETED'))
+    assert not subscription.matches(
+        _event('STATE_ALLOCATION_COMPLETED', 'other')
+    )
+    assert not subscription.matches({'msg': 'OTHER', 'data': None})
+
+
+def test_allocation_event_completes_the_wait():
+    rest, _ = _rest(_BEFORE)
+    message = rest._wait_allocation(
+        _subscription(_event('STATE_ALLOCATION_COMPLETED')), 1, _UUID,
+        _BEFORE, 5
+    )
+    assert message['msg'] == 'STATE_ALLOCATION_COMPLETED'
+
+
+def test_allocation_failure_event():
+    rest, _ = _rest(_BEFORE)
+    with pytest.raises(RuntimeError, match='не выполнено'):
+        rest._wait_allocation(
+            _subscription(_event('STATE_ALLOCATION_FAILED')), 1, _UUID,
+            _BEFORE, 5
+        )
+
+
+def test_failure_without_uuid_is_not_trusted():
+    rest, checks = _rest(_AFTER)
+    message = rest._wait_allocation(
+        _subscription({'msg': 'STATE_ALLOCATION_FAILED', 'data': None}),
+        1, _UUID, _BEFORE, 5
+    )
+    assert message['msg'] == 'STATE_ALLOCATION_CHECK_CHANGED'
+    assert checks == ['state_allocation/check']
+
+
+def test_unconfirmed_allocation_times_out():
+    rest, checks = _rest(_BEFORE)
+    with pytest.raises(RuntimeError, match='не завершилось'):
+        rest._wait_allocation(
+            _subscription({'msg': 'STATE_ALLOCATION_FAILED', 'data': None},
+                          {'msg': RECONNECTED, 'data': None}),
+            1, _UUID, _BEFORE, 0.2
+        )
+    assert len(checks) > 2
+
+
+def test_server_change_is_noticed_without_events():
+    rest, checks = _rest(_AFTER)
+    message = rest._wait_allocation(_subscription(), 1, _UUID, _BEFORE, 5)
+    assert message['msg'] == 'STATE_ALLOCATION_CHECK_CHANGED'
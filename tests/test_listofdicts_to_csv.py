@@ -0,0 +1,34 @@
+import os
+from zipfile import ZipFile
+
+import pytest
+
+from utils.listofdicts_to_csv import dict2csv, export_csv_zip
+
+
+def test_empty_input_raises_value_error(tmp_path):
+    zip_path = str(tmp_path / 'out.zip')
+    with pytest.raises(ValueError):
+        export_csv_zip([], zip_path, 'out.csv')
+    assert not os.path.exists(zip_path)
+
+
+def test_empty_generator_inside_generator(tmp_path):
+    def export():
+        yield export_csv_zip(iter(()), str(tmp_path / 'out.zip'), 'out.csv')
+
+    with pytest.raises(ValueError):
+        next(export())
+
+
+def test_rows_and_duplicates(tmp_path):
+    csv_path = str(tmp_path / 'out.csv')
+    stats = dict2csv(
+        [{'a': 1, 'b': 'x'}, {'a': 1, 'b': 'x'}, {'a': 2, 'b': 'y'}],
+        csv_path
+    )
+    assert (stats.rows, stats.duplicates) == (2, 1)
+    with ZipFile(str(tmp_path / 'out.zip')) as archive:
+        data = archive.read(archive.namelist()[0])
+    with open(csv_path, 'rb') as stream:
+        assert stream.read() == data == b'a,b\r\n1,x\r\n2,y\r\n'
@@ -0,0 +1,34 @@
+from utils.metrics import Metrics
+
+
+def test_mixed_label_types_export():
+    metrics = Metrics(prefix='test')
+    metrics.inc('requests_total', method='GET', endpoint='/a', status=200)
+    metrics.inc('requests_total', method='GET', endpoint='/a',
+                status='error')
+    metrics.inc('requests_total', method='GET', endpoint='/a', status=200)
+    text = metrics.to_prometheus()
+    assert 'test_requests_total{endpoint="/a",method="GET",status="200"} 2.0' \
+        in text
+    assert 'test_requests_total{endpoint="/a",method="GET",status="error"} ' \
+        '1.0' in text
+
+
+def test_int_and_str_labels_are_one_series():
+    metrics = Metrics(prefix='test')
+    metrics.inc('x_total', status=200)
+    metrics.inc('x_total', status='200')
+    assert metrics.to_prometheus().count('test_x_total{') == 1
+
+
+def test_events_are_capped(tmp_path):
+    metrics = Metrics(prefix='test', max_events=3)
+    for number in range(10):
+        metrics.event('request', number=number)
+    path = tmp_path / 'metrics.jsonl'
+    metrics.write_jsonl(str(path))
+    lines = path.read_text(encoding='utf-8').splitlines()
+    assert [line.count('"number": ') for line in lines] == [1, 1, 1]
+    assert '"number": 9' in lines[-1]
+    metrics.write_jsonl(str(path))
+    assert len(path.read_text(encoding='utf-8').splitlines()) == 3
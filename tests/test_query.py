@@ -0,0 +1,87 @@
+import pytest
+
+from ia_rest.cache import CollectionCache
+from ia_rest.query import Query, QueryCache
+
+
+def test_single_clause_is_sent_as_given():
+    assert Query('t').filter('a eq 1').filter_string == 'a eq 1'
+
+
+def test_clauses_are_parenthesized():
+    query = Query('t').filter('a eq 1 or b eq 2', c=3)
+    assert query.filter_string == '(a eq 1 or b eq 2) and (c eq 3)'
+
+
+def test_keyword_values():
+    query = Query('t').filter(a=None, b=True, c=1.5, d="it's")
+    assert query.where == (
+        'a eq null', 'b eq true', 'c eq 1.5', "d eq 'it\\'s'"
+    )
+
+
+def test_quoted_literals_are_kept():
+    query = Query('t').filter("name eq 'A  B'")
+    assert query.filter_string == "name eq 'A  B'"
+    assert query.key != Query('t').filter("name eq 'A B'").key
+
+
+def test_key_ignores_order_and_spacing():
+    first = Query('t').filter('a eq 1', "b  eq  'x  y'")
+    second = Query('t').filter("b eq 'x  y'").filter(' a   eq 1 ')
+    assert first.key == second.key
+    assert first == second and hash(first) == hash(second)
+    assert len(Query('t').filter('a eq 1', 'a  eq 1').where) == 1
+
+
+def test_order_projection_and_expansion_change_key():
+    query = Query('t').filter(a=1)
+    variants = [
+        query, query.order_by('id'), query.only('id'), query.expand('order')
+    ]
+    assert len({variant.key for variant in variants}) == 4
+    assert len({variant.cache_filter for variant in variants}) == 4
+    assert query.only('b', 'a', 'b').fields == ('a', 'b')
+    assert query.expand('x').expand('order').expanded == ('order', 'x')
+
+
+def test_builder_is_immutable():
+    query = Query('t')
+    filtered = query.filter(a=1).order_by('id')
+    assert query.is_plain and query.filter_string is None
+    assert not filtered.is_plain and filtered.order == ('id',)
+
+
+def test_projection():
+    rows = [{'id': 1, 'a': 2, 'b': 3}, {'id': 2}]
+    assert Query('t').only('id', 'a').project(rows) == [
+        {'a': 2, 'id': 1}, {'id': 2}
+    ]
+
+
+def test_unbound_query():
+    with pytest.raises(RuntimeError):
+        Query('t').all()
+
+
+def test_query_cache_lru():
+    cache = QueryCache(maxsize=2)
+    cache.put(('a',), 1)
+    cache.put(('b',), 2)
+    assert cache.get(('a',)) == 1
+    cache.put(('c',), 3)
+    assert cache.get(('b',)) is None
+    assert (cache.get(('a',)), cache.get(('c',))) == (1, 3)
+    cache.invalidate('a')
+    assert cache.get(('a',)) is None and len(cache) == 1
+
+
+def test_disk_cache_keeps_quoted_spacing_apart(tmp_path):
+    cache = CollectionCache(str(tmp_path))
+    spaced = Query('t').filter("name eq 'A  B'")
+    single = Query('t').filter("name eq 'A B'")
+    cache.put('t', [{'id': 1}], spaced.cache_filter)
+    assert cache.get('t', single.cache_filter) is None
+    assert cache.get('t', spaced.cache_filter) == [{'id': 1}]
+    same = Query('t').filter("name   eq 'A  B'")
+    assert cache.get('t', same.cache_filter) == [{'id': 1}]
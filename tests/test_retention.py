@@ -0,0 +1,47 @@
+import pytest
+
+from ia_rest.retention import RetentionPolicy, SessionRetention
+
+
+class _Rest(object):
+
+    def __init__(self, sessions):
+        self.sessions = sessions
+        self.deleted = []
+
+    def _iter_collection_pages(self, table):
+        yield list(self.sessions)
+
+    def _get_main_session(self):
+        return 1
+
+    def delete_simulation(self, simulation_session_id):
+        self.deleted.append(simulation_session_id)
+        return {}
+
+
+def _sessions():
+    return [{'id': number, 'status': 0, 'plan_id': 1}
+            for number in range(1, 6)]
+
+
+def test_policy_without_keep_rules_is_refused():
+    rest = _Rest(_sessions())
+    retention = SessionRetention(rest, RetentionPolicy(), rate=0)
+    with pytest.raises(ValueError):
+        retention.apply()
+    assert rest.deleted == []
+
+
+def test_policy_without_keep_rules_dry_run():
+    rest = _Rest(_sessions())
+    report = SessionRetention(rest, RetentionPolicy(), rate=0)\
+        .apply(dry_run=True)
+    assert (report.kept, report.deleted, report.dry_run) == (1, 4, True)
+    assert rest.deleted == []
+
+
+def test_keep_last_keeps_newest_and_primary():
+    kept, deleted = RetentionPolicy(keep_last=2).split(_sessions(), 1)
+    assert [row['id'] for row in kept] == [5, 4, 1]
+    assert [row['id'] for row in deleted] == [3, 2]
@@ -0,0 +1,97 @@
+import time
+
+import pytest
+
+from runner.scripts import ScriptRunner, read_scripts
+
+
+def _run(config, **kwargs):
+    lines = []
+    results = ScriptRunner(read_scripts(config), write=lines.append,
+                           **kwargs).run()
+    return {result.name: result for result in results}, lines
+
+
+def test_plain_list_runs_in_order_and_past_failures(tmp_path):
+    log = tmp_path / 'log'
+    results, _ = _run([f'echo a >> {log}', f'echo b >> {log}; exit 3',
+                       f'echo c >> {log}'], concurrency=4)
+    assert log.read_text().split() == ['a', 'b', 'c']
+    assert [result.status for result in results.values()] == \
+        ['ok', 'failed', 'ok']
+    assert results[f'echo b >> {log}; exit 3'].returncode == 3
+
+
+def test_skip_propagates_through_after():
+    results, lines = _run([
+        {'name': 'build', 'run': 'exit 1'},
+        {'name': 'test', 'run': 'true', 'after': 'build'},
+        {'name': 'deploy', 'run': 'true', 'after': ['test']},
+        {'name': 'notify', 'run': 'true', 'after': []},
+    ], concurrency=2)
+    assert {name: result.status for name, result in results.items()} == {
+        'build': 'failed', 'test': 'skipped', 'deploy': 'skipped',
+        'notify': 'ok',
+    }
+    assert any('deploy пропущен' in line for line in lines)
+
+
+def test_completed_scripts_count_as_done():
+    results, _ = _run([
+        {'name': 'build', 'run': 'exit 1'},
+        {'name': 'test', 'run': 'true', 'after': 'build'},
+    ], completed={'build'})
+    assert results['build'].status == 'done'
+    assert results['test'].status == 'ok'
+
+
+def test_concurrency_cap(tmp_path):
+    log = tmp_path / 'log'
+    command = f'echo + >> {log}; sleep 0.2; echo - >> {log}'
+    config = [{'name': str(number), 'run': command, 'after': []}
+              for number in range(6)]
+    started = time.monotonic()
+    _run(config, concurrency=2)
+    seconds = time.monotonic() - started
+    depth = peak = 0
+    for mark in log.read_text().split():
+        depth += 1 if mark == '+' else -1
+        peak = max(peak, depth)
+    assert peak == 2
+    assert 0.55 < seconds < 2
+
+
+def test_timeout_kills_the_process_group(tmp_path):
+    marker = tmp_path / 'survived'
+    started = time.monotonic()
+    results, _ = _run([{'name': 'slow', 'timeout': 0.2,
+                        'run': f'sleep 2 && touch {marker}'}])
+    assert results['slow'].status == 'timeout'
+    assert time.monotonic() - started < 1.5
+    time.sleep(2)
+    assert not marker.exists()
+
+
+def test_env_and_output(tmp_path):
+    results, lines = _run([{'name': 'env', 'run': 'echo "$GREETING"',
+                            'env': {'GREETING': 'hello'}}])
+    assert results['env'].status == 'ok'
+    assert '[env] hello' in lines
+
+
+def test_duplicate_names_get_numbers():
+    assert [script.name for script in read_scripts(['true', 'true'])] == \
+        ['true', 'true#2']
+
+
+def test_unknown_dependency_is_rejected():
+    with pytest.raises(ValueError, match='неизвестного'):
+        read_scripts([{'name': 'a', 'run': 'true', 'after': 'missing'}])
+
+
+def test_cycle_is_rejected():
+    with pytest.raises(ValueError, match='Циклическая'):
+        read_scripts([
+            {'name': 'a', 'run': 'true', 'after': 'b'},
+            {'name': 'b', 'run': 'true', 'after': 'a'},
+        ])
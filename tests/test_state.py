@@ -0,0 +1,26 @@
+import os
+
+from runner.state import StateLocked, StateStore
+
+
+def test_lock_for_url_instance(tmp_path):
+    store = StateStore(str(tmp_path / 'session.yml'))
+    with store.lock('https://b--plant.bfg-soft.ru'):
+        pass
+    names = os.listdir(str(tmp_path))
+    assert len(names) == 1
+    assert '/' not in names[0] and names[0].endswith('.lock')
+
+
+def test_lock_is_exclusive_per_instance(tmp_path):
+    store = StateStore(str(tmp_path / 'session.yml'))
+    with store.lock('https://a.example/'):
+        with store.lock('https://b.example/'):
+            pass
+        try:
+            with store.lock('https://a.example/'):
+                pass
+        except StateLocked:
+            pass
+        else:
+            raise AssertionError('second lock of the same instance taken')
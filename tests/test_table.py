@@ -0,0 +1,111 @@
+import pickle
+
+import pytest
+
+from ia_rest.table import CollectionTable
+
+_ROWS = [
+    {'id': 1, 'name': 'a', 'price': 1.5, 'parent_id': None, 'flag': True},
+    {'id': 2, 'name': None, 'price': None, 'parent_id': 1, 'flag': False},
+    {'id': 3, 'name': 'c', 'price': 2.0, 'parent_id': 1 << 70},
+    {'id': 4, 'name': 'a', 'price': 3, 'parent_id': 2, 'extra': 'x'},
+]
+
+
+def _expected(rows):
+    columns = []
+    for row in rows:
+        for key in row:
+            if key not in columns:
+                columns.append(key)
+    return [{key: row.get(key) for key in columns} for row in rows]
+
+
+def test_round_trip_of_mixed_null_and_oversized_values():
+    table = CollectionTable(_ROWS, name='t')
+    assert len(table) == 4
+    assert table.to_dicts() == _expected(_ROWS)
+    assert table['parent_id'] == [None, 1, 1 << 70, 2]
+    assert table['price'] == [1.5, None, 2.0, 3]
+    assert type(table['price'][3]) is int
+    assert table['flag'] == [True, False, None, None]
+    assert table['extra'] == [None, None, None, 'x']
+
+
+def test_column_kinds():
+    table = CollectionTable([{'i': None, 'f': 1.0, 's': 'x'},
+                             {'i': 5, 'f': None, 's': 'y'}])
+    kinds = {name: column.kind for name, column in table._columns.items()}
+    assert kinds == {'i': 'q', 'f': 'd', 's': 'o'}
+    assert table['i'] == [None, 5]
+    assert table['f'] == [1.0, None]
+
+
+def test_promotion_after_nulls_keeps_values():
+    table = CollectionTable([{'v': None}, {'v': 1}, {'v': None},
+                             {'v': 'text'}, {'v': 2}])
+    assert table['v'] == [None, 1, None, 'text', 2]
+
+
+def test_all_null_column():
+    table = CollectionTable([{'v': None}, {'v': None}])
+    assert table['v'] == [None, None]
+    assert table[1]['v'] is None
+
+
+def test_rows_and_negative_indexes():
+    table = CollectionTable(_ROWS)
+    assert table[-1]['extra'] == 'x'
+    assert dict(table[0]) == _expected(_ROWS)[0]
+    with pytest.raises(IndexError):
+        table[4]
+
+
+def test_views_share_storage():
+    table = CollectionTable(_ROWS)
+    view = table[1:3]
+    assert len(view) == 2
+    assert view.to_dicts() == _expected(_ROWS)[1:3]
+    assert view['id'] == [2, 3]
+    assert view[-1]['id'] == 3
+    assert view[::-1]['id'] == [3, 2]
+    assert table[::2]['name'] == ['a', 'c']
+    assert view._columns is table._columns
+    with pytest.raises(TypeError):
+        view.extend([{'id': 5}])
+
+
+def test_empty_views():
+    table = CollectionTable(_ROWS)
+    empty = table[2:2]
+    assert len(empty) == 0
+    assert empty.to_dicts() == []
+    assert empty['id'] == []
+    assert empty[0:5]['id'] == []
+    assert pickle.loads(pickle.dumps(empty)).to_dicts() == []
+
+
+def test_pickle_round_trip():
+    table = CollectionTable(_ROWS, name='t')
+    restored = pickle.loads(pickle.dumps(table))
+    assert restored.name == 't'
+    assert restored.to_dicts() == table.to_dicts()
+    restored.extend([{'id': 5}])
+    assert restored['id'] == [1, 2, 3, 4, 5]
+
+
+def test_pickled_view_is_compacted():
+    table = CollectionTable(_ROWS, name='t')
+    restored = pickle.loads(pickle.dumps(table[1:3]))
+    assert restored._index is None
+    assert len(restored._columns['id']) == 2
+    assert restored.to_dicts() == _expected(_ROWS)[1:3]
+
+
+def test_copy_and_extend():
+    table = CollectionTable(name='t')
+    table += _ROWS[:2]
+    table += _ROWS[2:]
+    assert table.to_dicts() == _expected(_ROWS)
+    copy = table[1:].copy()
+    assert copy.to_dicts() == _expected(_ROWS)[1:]
@@ -0,0 +1,81 @@
+import gzip
+import os
+
+import pytest
+
+from bench.fake_bfg import FakeBFG
+from ia_rest.iarest import IARest
+from ia_rest.upload import MultipartFile, gzip_chunks
+
+
+@pytest.fixture
+def data_file(tmp_path):
+    path = tmp_path / 'plan "v2".xml'
+    path.write_bytes(os.urandom((1 << 20) + 12345))
+    return str(path)
+
+
+def _expected_body(content_type, path):
+    boundary = content_type.split('boundary=', 1)[1]
+    with open(path, 'rb') as stream:
+        data = stream.read()
+    filename = path.replace('"', '%22')
+    return (
+        f'--{boundary}\r\n'
+        f'Content-Disposition: form-data; name="data"; '
+        f'filename="{filename}"\r\n'
+        f'Content-Type: application/xml\r\n\r\n'
+    ).encode('utf-8') + data + f'\r\n--{boundary}--\r\n'.encode('ascii')
+
+
+def test_read_and_iteration_agree_with_len(data_file):
+    with MultipartFile(data_file, chunk_size=1000) as body:
+        chunks = list(body)
+        expected = _expected_body(body.content_type, data_file)
+    assert b''.join(chunks) == expected
+    assert len(MultipartFile(data_file)) == len(expected)
+    assert max(len(chunk) for chunk in chunks) == 1000
+
+    with MultipartFile(data_file) as body:
+        parts = [body.read(7), body.read(300000), body.read()]
+        assert body.read() == b''
+        expected = _expected_body(body.content_type, data_file)
+    assert b''.join(parts) == expected
+
+
+def test_gzip_chunks_round_trip(data_file):
+    with MultipartFile(data_file) as body:
+        compressed = b''.join(gzip_chunks(body))
+        expected = _expected_body(body.content_type, data_file)
+    assert gzip.decompress(compressed) == expected
+
+
+def _upload(data_file, compress):
+    with FakeBFG(rows=1) as bfg:
+        with IARest.from_config(bfg.config()) as ia:
+            answer = ia._perform_upload(data_file, compress=compress)
+        return answer, bfg.uploads
+
+
+def test_plain_upload_sends_the_announced_length(data_file):
+    answer, uploads = _upload(data_file, compress=False)
+    upload, = uploads
+    headers = upload['headers']
+    expected = _expected_body(headers['Content-Type'], data_file)
+    assert upload['body'] == expected
+    assert int(headers['Content-Length']) == upload['wire_bytes'] == \
+        len(expected) == len(MultipartFile(data_file))
+    assert 'Transfer-Encoding' not in headers
+    assert answer == f'upload/{len(expected)}'
+
+
+def test_gzip_upload(data_file):
+    answer, uploads = _upload(data_file, compress=True)
+    upload, = uploads
+    headers = upload['headers']
+    expected = _expected_body(headers['Content-Type'], data_file)
+    assert headers['Content-Encoding'] == 'gzip'
+    assert headers['Transfer-Encoding'] == 'chunked'
+    assert upload['body'] == expected
+    assert len(expected) == len(MultipartFile(data_file))
+    assert answer == f'upload/{len(expected)}'
@@ -0,0 +1,101 @@
+import time
+from itertools import islice
+from threading import Timer
+
+import pytest
+
+from ia_rest.events import Subscription
+from ia_rest.wait import WaitCancelled, Waiter
+from utils.metrics import Metrics
+
+
+class _Stream(object):
+
+    def unsubscribe(self, subscription):
+        pass
+
+
+def _counter(succeed_after):
+    calls = []
+
+    def check():
+        calls.append(time.monotonic())
+        return 'done' if len(calls) > succeed_after else None
+
+    return check, calls
+
+
+def test_delays_grow_up_to_the_cap():
+    waiter = Waiter(initial=1, factor=2, max_interval=5, jitter=0)
+    assert list(islice(waiter.delays(), 6)) == [1, 2, 4, 5, 5, 5]
+    assert list(islice(waiter.delays(initial=3, max_interval=4), 3)) == \
+        [3, 4, 4]
+
+
+def test_jitter_stays_in_bounds():
+    waiter = Waiter(initial=10, max_interval=10, jitter=0.2)
+    assert all(8 <= delay <= 12 for delay in islice(waiter.delays(), 100))
+
+
+def test_poll_returns_first_accepted_result():
+    check, calls = _counter(succeed_after=2)
+    metrics = Metrics(prefix='test')
+    waiter = Waiter(initial=0.01, jitter=0, metrics=metrics)
+    assert waiter.poll(check, 'test') == 'done'
+    assert len(calls) == 3
+    assert 'test_wait_seconds_total{reason="test"}' in metrics.to_prometheus()
+
+
+def test_poll_deadline():
+    check, calls = _counter(succeed_after=10 ** 6)
+    waiter = Waiter(initial=0.05, max_interval=0.05, jitter=0)
+    started = time.monotonic()
+    with pytest.raises(TimeoutError):
+        waiter.poll(check, 'test', timeout=0.2)
+    assert time.monotonic() - started < 1
+    assert len(calls) >= 3
+
+
+def test_reason_overrides():
+    check, calls = _counter(succeed_after=10 ** 6)
+    waiter = Waiter(initial=60, reasons={'slow': {'initial': 0.01,
+                                                  'timeout': 0.1}})
+    with pytest.raises(TimeoutError):
+        waiter.poll(check, 'slow', timeout=100)
+    assert len(calls) > 2
+
+
+def test_cancel_without_subscription():
+    check, _ = _counter(succeed_after=10 ** 6)
+    waiter = Waiter(initial=60, jitter=0)
+    Timer(0.1, waiter.cancel.set).start()
+    started = time.monotonic()
+    with pytest.raises(WaitCancelled):
+        waiter.poll(check, 'test')
+    assert time.monotonic() - started < 2
+
+
+def test_cancel_while_waiting_on_subscription():
+    check, _ = _counter(succeed_after=10 ** 6)
+    waiter = Waiter(initial=60, jitter=0, cancel_check_interval=0.05)
+    subscription = Subscription(_Stream())
+    Timer(0.1, waiter.cancel.set).start()
+    started = time.monotonic()
+    with pytest.raises(WaitCancelled):
+        waiter.poll(check, 'test', subscription=subscription)
+    assert time.monotonic() - started < 2
+
+
+def test_subscription_message_cuts_the_delay_short():
+    subscription = Subscription(_Stream())
+
+    def check():
+        messages = subscription.drain()
+        return messages[0] if messages else None
+
+    waiter = Waiter(initial=60, jitter=0, cancel_check_interval=0.05)
+    Timer(0.1, subscription.put, ({'msg': 'DONE'},)).start()
+    started = time.monotonic()
+    assert waiter.poll(check, 'test', subscription=subscription) == \
+        {'msg': 'DONE'}
+    assert time.monotonic() - started < 2
@@ -0,0 +1,18 @@
+import sys
+
+__all__ = [
+    'write',
+]
+
+
+def write(text):
+    """
+    Prints a line through tqdm.write if tqdm is loaded, so that progress
+    bars are not broken, and with a plain print otherwise: the quick cron
+    check never has to import tqdm.
+    """
+    tqdm = sys.modules.get('tqdm')
+    if tqdm is None:
+        print(text)
+    else:
+        tqdm.tqdm.write(text)
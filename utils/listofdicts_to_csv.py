@@ -1,26 +1,118 @@
 import csv
+import os
+import time
+from collections import namedtuple
+from contextlib import ExitStack
+from hashlib import blake2b
+from itertools import chain
+from logging import getLogger
 from zipfile import ZipFile, ZIP_DEFLATED
 
+__all__ = [
+    'ExportStats',
+    'dict2csv',
+    'export_csv_zip',
+]
 
-def dict2csv(dictlist, csvfile):
+ExportStats = namedtuple(
+    'ExportStats',
+    ['rows', 'duplicates', 'seconds', 'bytes']
+)
+
+_logger = getLogger(__name__)
+
+
+class _Utf8Sink(object):
+    """File-like object for csv.writer that sends UTF-8 to several streams."""
+
+    def __init__(self, *streams):
+        self._streams = streams
+        self.bytes = 0
+
+    def write(self, text):
+        data = text.encode('utf-8')
+        for stream in self._streams:
+            stream.write(data)
+        self.bytes += len(data)
+        return len(text)
+
+
+def _row_digest(row):
+    return blake2b(
+        repr(tuple(row.values())).encode('utf-8'),
+        digest_size=16
+    ).digest()
+
+
+def _arcname(path):
+    arcname = os.path.normpath(os.path.splitdrive(path)[1])
+    return arcname.lstrip(os.sep + (os.altsep or ''))
+
+
+def export_csv_zip(rows, zipfile, arcname, csvfile=None, compresslevel=5,
+                   deduplicate=True):
     """
-    Takes a list of dictionaries as input and outputs a CSV file.
+    Writes an iterable of dictionaries as CSV straight into the `arcname`
+    entry of a deflated zip archive in one pass, optionally also into a
+    plain `csvfile`. Duplicate rows are dropped by a 16-byte hash of their
+    values, so memory grows with the number of distinct rows only.
+
+    Raises ValueError for no rows, as there is no header to write; nothing
+    is created then.
     """
-    keys = dictlist[0].keys()
-    unique_rows = set()
-    result = []
-
-    for row in dictlist:
-        if str(row) in unique_rows:
-            continue
-        unique_rows.add(str(row))
-        result.append(row)
-
-    with open(csvfile, 'w', newline='', encoding="utf-8") as output_file:
-        dict_writer = csv.DictWriter(output_file, keys)
+    started = time.perf_counter()
+    rows = iter(rows)
+    first = next(rows, None)
+    if first is None:
+        raise ValueError(f'Нет строк для выгрузки в {zipfile!r}')
+    seen = set()
+    written = duplicates = 0
+
+    with ExitStack() as stack:
+        archive = stack.enter_context(ZipFile(
+            zipfile, 'w', ZIP_DEFLATED, compresslevel=compresslevel
+        ))
+        streams = [stack.enter_context(
+            archive.open(arcname, 'w', force_zip64=True)
+        )]
+        if csvfile is not None:
+            streams.append(stack.enter_context(open(csvfile, 'wb')))
+        sink = _Utf8Sink(*streams)
+
+        dict_writer = csv.DictWriter(sink, first.keys())
         dict_writer.writeheader()
-        dict_writer.writerows(result)
+        for row in chain((first,), rows):
+            if deduplicate:
+                digest = _row_digest(row)
+                if digest in seen:
+                    duplicates += 1
+                    continue
+                seen.add(digest)
+            dict_writer.writerow(row)
+            written += 1
 
-    with ZipFile(f'{csvfile.split(".")[0]}.zip',
-                 'w', ZIP_DEFLATED, compresslevel=5) as zip_object:
-        zip_object.write(csvfile)
+    stats = ExportStats(written, duplicates,
+                        time.perf_counter() - started, sink.bytes)
+    _logger.info(
+        'Выгружено {} строк ({} дублей) в {!r} за {:.1f} с: '
+        '{:.0f} строк/с, {:.1f} МБ/с'.format(
+            stats.rows, stats.duplicates, zipfile, stats.seconds,
+            stats.rows / stats.seconds if stats.seconds else 0,
+            stats.bytes / 2 ** 20 / stats.seconds if stats.seconds else 0
+        )
+    )
+    return stats
+
+
+def dict2csv(dictlist, csvfile, compresslevel=5):
+    """
+    Takes a list (or any iterable, e.g. IARest.iter_rest_collection) of
+    dictionaries as input and outputs a CSV file and its zip archive.
+    """
+    return export_csv_zip(
+        dictlist,
+        f'{csvfile.split(".")[0]}.zip',
+        _arcname(csvfile),
+        csvfile=csvfile,
+        compresslevel=compresslevel
+    )
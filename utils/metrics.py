@@ -0,0 +1,181 @@
+import json
+import os
+import re
+import time
+from bisect import bisect_left
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from tempfile import mkstemp
+from threading import Lock
+
+__all__ = [
+    'Metrics',
+    'REGISTRY',
+    'endpoint_of',
+]
+
+_LATENCY_BUCKETS = (
+    0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 900, 3600
+)
+
+_ID_SEGMENT = re.compile(r'/\d+(?=/|$)')
+
+
+def endpoint_of(uri):
+    """'/data/static_result/15/x?start=0' -> '/data/static_result/:id/x'"""
+    path = uri.split('?', 1)[0]
+    if not path.startswith('/'):
+        path = '/' + path
+    return _ID_SEGMENT.sub('/:id', path)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(
+        '{}="{}"'.format(
+            key,
+            str(value).replace('\\', '\\\\').replace('"', '\\"')
+            .replace('\n', '\\n')
+        )
+        for key, value in labels
+    ) + '}'
+
+
+class _Histogram(object):
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        index = bisect_left(self.buckets, value)
+        if index < len(self.counts):
+            self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+
+
+class Metrics(object):
+    """
+    Thread-safe in-process metrics: counters, gauges and histograms keyed by
+    name and labels, plus a list of structured events. Exported as a
+    Prometheus textfile (for node_exporter's textfile collector) and as
+    JSON lines.
+
+    Label values are kept as strings, so one series may mix e.g. numeric
+    and 'error' statuses. Only the last `max_events` events are kept until
+    write_jsonl drains them.
+    """
+
+    def __init__(self, prefix='start_if_new_session', max_events=10000):
+        self.prefix = prefix
+        self._lock = Lock()
+        self._counters = defaultdict(float)
+        self._gauges = {}
+        self._histograms = {}
+        self._events = deque(maxlen=max_events)
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(
+            (key, str(value)) for key, value in labels.items()
+        ))
+
+    def inc(self, name, value=1, **labels):
+        with self._lock:
+            self._counters[self._key(name, labels)] += value
+
+    def set(self, name, value, **labels):
+        with self._lock:
+            self._gauges[self._key(name, labels)] = value
+
+    def observe(self, name, value, buckets=_LATENCY_BUCKETS, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = _Histogram(buckets)
+            histogram.observe(value)
+
+    def event(self, kind, **fields):
+        with self._lock:
+            self._events.append({'ts': time.time(), 'event': kind, **fields})
+
+    @contextmanager
+    def timer(self, name, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def to_prometheus(self):
+        lines = []
+        with self._lock:
+            for kind, values in (('counter', self._counters),
+                                 ('gauge', self._gauges)):
+                declared = set()
+                for (name, labels), value in sorted(values.items()):
+                    full_name = f'{self.prefix}_{name}'
+                    if full_name not in declared:
+                        declared.add(full_name)
+                        lines.append(f'# TYPE {full_name} {kind}')
+                    lines.append(
+                        f'{full_name}{_format_labels(labels)} {value}'
+                    )
+            declared = set()
+            for (name, labels), histogram in sorted(
+                    self._histograms.items(), key=lambda item: item[0]):
+                full_name = f'{self.prefix}_{name}'
+                if full_name not in declared:
+                    declared.add(full_name)
+                    lines.append(f'# TYPE {full_name} histogram')
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append('{}_bucket{} {}'.format(
+                        full_name,
+                        _format_labels(labels + (('le', bound),)),
+                        cumulative
+                    ))
+                lines.append('{}_bucket{} {}'.format(
+                    full_name,
+                    _format_labels(labels + (('le', '+Inf'),)),
+                    histogram.count
+                ))
+                lines.append(f'{full_name}_sum{_format_labels(labels)} '
+                             f'{histogram.sum}')
+                lines.append(f'{full_name}_count{_format_labels(labels)} '
+                             f'{histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+    def write_textfile(self, path):
+        """Atomically replaces `path` with the Prometheus text format."""
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as stream:
+            stream.write(self.to_prometheus())
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+
+    def write_jsonl(self, path):
+        """Appends and forgets the events collected so far."""
+        with self._lock:
+            events = list(self._events)
+            self._events.clear()
+        with open(path, 'a', encoding='utf-8') as stream:
+            for event in events:
+                stream.write(json.dumps(event, ensure_ascii=False))
+                stream.write('\n')
+
+    def export(self, config):
+        if config.get('textfile'):
+            self.write_textfile(config['textfile'])
+        if config.get('jsonl'):
+            self.write_jsonl(config['jsonl'])
+
+
+REGISTRY = Metrics()